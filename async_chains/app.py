@@ -1,6 +1,5 @@
 from langchain_google_genai import GoogleGenerativeAI, HarmCategory, HarmBlockThreshold
 from langchain_openai import ChatOpenAI
-from langsmith import Client
 from langchain_community.document_loaders.generic import GenericLoader
 from langchain_community.document_loaders.parsers import LanguageParser
 from langchain_core.output_parsers import StrOutputParser
@@ -11,12 +10,18 @@ import traceback
 import time
 import asyncio
 import os
+import sys
 
+# Modules shared between the apps live in the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tracing import configure_tracing
+from common.instrumentation import install_instrumentation, print_metrics
 
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
-os.environ["LANGCHAIN_PROJECT"] = f"gensec-hw5"
-os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
-client = Client()
+
+# Traces go to LangSmith unless TRACING_MODE=local (sampled, compressed file) or TRACING_MODE=off is set.
+configure_tracing("gensec-hw5")
+# Latency, time-to-first-token and token counts of every run, shown by the "stats" command.
+metrics = install_instrumentation()
 
 
 gemini_llm = GoogleGenerativeAI(
@@ -28,12 +33,50 @@ gemini_llm = GoogleGenerativeAI(
         HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE, 
     }
 )
-gpt_llm = ChatOpenAI(model="gpt-4o", temperature=0)
+gpt_llm = ChatOpenAI(model="gpt-4o", temperature=0, stream_usage=True)
 
 
 # Maximum tokens allowed for a prompt, otherwise the chain call will be rejected.
 MAX_PROMPT_TOKENS = 1000
 
+GENERATIVE_PROMPT = PromptTemplate.from_template(dedent("""You are an expert at spotting security vulnerabilities and bad practice in C and C++ code.
+    Your job is to take in a segment of code and identify the top three vulnerabilities that can be found in it.
+    Keep your answer concise, but list out the top three results with enough detail that the reader can understand how to solve the security issue.
+    If you can't find three important vulnerabilities, do not make any up. Just list as many as you can, up to three.
+    You are allowed to reference functions and one-line bits of code to help the reader, but do not include code blocks in your answer. Print all code lines on a new line.
+    Your answer should be in the following format:
+    Here are [number, 3 or less] of the top security vulnerabilities in the provided [language] code.
+    1. [vulnerability 1]
+       - Issue: [explanation of vulnerability]
+       - Recommendation: [explanation of solution]
+
+    ... and so on.
+
+    Code content: 
+    {code_content}
+"""))
+
+VERIFYING_PROMPT = PromptTemplate.from_template(dedent("""You are an expert at veryifying security vulnerabilities in C and C++ code.
+    Your job is to take in a segment of code and a list of potential vulnerabilities in it, and check if the reasoning for the issues listed is accurate. 
+    If the reasoning is incorrect or there are more important/dangerous vulnerabilities in the code provided, replace any number of the original vulnerabilities
+    with an updated version of the vulnerability or a more important vulnerability.
+    Keep your answer concise, but list out the top three results with enough detail that the reader can understand how to solve the security issue.
+    If you can't find three important vulnerabilities, do not make any up. Just list as many as you can, up to three.
+    You are allowed to reference functions and one-line bits of code to help the reader, but do not include code blocks in your answer. Print all code lines on a new line.
+    Your answer should be in the following format:
+    Here are [number, 3 or less] of the top security vulnerabilities in the provided [language] code.
+    1. [vulnerability 1]
+       - Issue: [explanation of vulnerability]
+       - Recommendation: [explanation of solution]
+
+    ... and so on.
+
+    Code content: 
+    {code_content}
+    List of vulnerabilities to verify: 
+    {previous_results}
+"""))
+
 
 
 def load_code(file_name) -> str:
@@ -95,70 +138,45 @@ async def dual_chains(chain_one, chain_two, document):
     return result_one.result(), result_two.result()
 
 
+def create_vulnerability_chain(llm):
+    """ Builds the chain that has a model list the top vulnerabilities in a piece of code, then verify its own list.
+    The chain holds no per-request state, so one chain per model can serve any number of concurrent calls.
 
+    Args:
+        llm (LangChain LLM object): model used for both steps
 
-
-
-def main():
-    code_chain = lambda prompt, llm: (
+    Returns:
+        LangChain RunnableSequence: chain taking {"code_content": str} and returning the verified list as a string
+    """
+    code_chain = lambda prompt: (
     prompt 
     | llm
     | StrOutputParser()
     )
 
-    final_chain = lambda prompt, verifying_prompt, llm: (
-    {"code_content": itemgetter("code_content"), "previous_results":code_chain(prompt, llm)} 
-    | code_chain(verifying_prompt, llm)
+    return (
+    {"code_content": itemgetter("code_content"), "previous_results": code_chain(GENERATIVE_PROMPT)} 
+    | code_chain(VERIFYING_PROMPT)
     )
 
 
-    generative_prompt = PromptTemplate.from_template(dedent("""You are an expert at spotting security vulnerabilities and bad practice in C and C++ code.
-        Your job is to take in a segment of code and identify the top three vulnerabilities that can be found in it.
-        Keep your answer concise, but list out the top three results with enough detail that the reader can understand how to solve the security issue.
-        If you can't find three important vulnerabilities, do not make any up. Just list as many as you can, up to three.
-        You are allowed to reference functions and one-line bits of code to help the reader, but do not include code blocks in your answer. Print all code lines on a new line.
-        Your answer should be in the following format:
-        Here are [number, 3 or less] of the top security vulnerabilities in the provided [language] code.
-        1. [vulnerability 1]
-           - Issue: [explanation of vulnerability]
-           - Recommendation: [explanation of solution]
-
-        ... and so on.
-
-        Code content: 
-        {code_content}
-    """))
-
-    verifying_prompt= PromptTemplate.from_template(dedent("""You are an expert at veryifying security vulnerabilities in C and C++ code.
-        Your job is to take in a segment of code and a list of potential vulnerabilities in it, and check if the reasoning for the issues listed is accurate. 
-        If the reasoning is incorrect or there are more important/dangerous vulnerabilities in the code provided, replace any number of the original vulnerabilities
-        with an updated version of the vulnerability or a more important vulnerability.
-        Keep your answer concise, but list out the top three results with enough detail that the reader can understand how to solve the security issue.
-        If you can't find three important vulnerabilities, do not make any up. Just list as many as you can, up to three.
-        You are allowed to reference functions and one-line bits of code to help the reader, but do not include code blocks in your answer. Print all code lines on a new line.
-        Your answer should be in the following format:
-        Here are [number, 3 or less] of the top security vulnerabilities in the provided [language] code.
-        1. [vulnerability 1]
-           - Issue: [explanation of vulnerability]
-           - Recommendation: [explanation of solution]
-
-        ... and so on.
-
-        Code content: 
-        {code_content}
-        List of vulnerabilities to verify: 
-        {previous_results}
-    """))
-
-    gemini_chain = final_chain(generative_prompt, verifying_prompt, gemini_llm)
-    gpt_chain = final_chain(generative_prompt, verifying_prompt, gpt_llm)
+
+
+
+
+def main():
+    gemini_chain = create_vulnerability_chain(gemini_llm)
+    gpt_chain = create_vulnerability_chain(gpt_llm)
 
 
     print("\n\nWelcome to C/C++ Vulnerability Identifier. Store a C/C++ file in the sources folder and enter its name to have its vulnerabilities checked!")
 
     while True:
         try:
-            line = input("\n\nEnter query (\"exit\" to end) >>  ")
+            line = input("\n\nEnter query (\"stats\" for latency, \"exit\" to end) >>  ")
+            if line == "stats":
+                print_metrics(metrics)
+                continue
             if line and line != "exit": 
                 document = load_code(line)
                 document_token_count = gemini_llm.get_num_tokens(document)
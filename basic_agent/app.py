@@ -1,21 +1,33 @@
 from langchain_google_genai import GoogleGenerativeAI, HarmCategory, HarmBlockThreshold
 from langchain.agents import AgentExecutor, create_react_agent, load_tools
 from langchain_core.pydantic_v1 import BaseModel, Field, validator
-from langchain.memory import ConversationBufferMemory
 from langchain_openai import ChatOpenAI
 from langchain.tools import tool
 from langsmith import Client
-from langchain import hub
 from textwrap import dedent
 import traceback
+import asyncio
 import json
+import time
 import os
+import sys
 
+# Modules shared between the apps live in the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.prompt_registry import load_prompt, refresh_prompt
+from common.tracing import configure_tracing
+from common.instrumentation import install_instrumentation, print_metrics
+from bounded_memory import SharedConversationStore, BoundedSummaryMemory
+from project_stats import ProjectStatsCache, top_projects
 
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
-os.environ["LANGCHAIN_PROJECT"] = f"gensec-hw2"
-os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
+
+# Traces go to LangSmith unless TRACING_MODE=local (sampled, compressed file) or TRACING_MODE=off is set.
+configure_tracing("gensec-hw2")
+# Latency, time-to-first-token and token counts of every run, shown by the "stats" command.
+metrics = install_instrumentation()
 client = Client()
+# Project stats are reused for a minute, since agents often ask about the same project several times.
+project_stats = ProjectStatsCache(client, ttl_seconds=60)
 
 
 class ProjectNameInput(BaseModel):
@@ -28,40 +40,65 @@ class ProjectNameInput(BaseModel):
     project_name: str = Field(description="Should be a string of text of the user's choice for an existing project name.")
 
 
+class ProjectNamesInput(BaseModel):
+    """
+    This class enforces typechecking in the projects_token_summary tool.
+    It extends the BaseModel class from Pydantic. 
+    :param project_names: comma-separated names of projects in the LangSmith client
+    :type project_names: str
+    """
+    project_names: str = Field(description="Should be a comma-separated list of existing project names, such as gensec-hw1, gensec-hw2")
+
+
 @tool("project_token_info", args_schema=ProjectNameInput, return_direct=False)
 def project_token_info(project_name):
     """
     This tool takes a project name and returns a string containing info about 
     the tokens used for that specific project in LangSmith.
     """
-    results = client.read_project(project_name=project_name)
-    run_count = results.run_count
-    prompt_tokens = results.prompt_tokens
-    completion_tokens = results.completion_tokens
-    token_info = dict(
-        run_count=run_count, 
-        prompt_tokens_used=prompt_tokens,
-        completion_tokens_generated=completion_tokens,
-    )
-    return json.dumps(token_info)
+    return json.dumps(project_stats.project_stats(project_name))
+
+
+@tool("projects_token_summary", args_schema=ProjectNamesInput, return_direct=False)
+def projects_token_summary(project_names):
+    """
+    This tool takes several comma-separated project names and returns the run and token counts 
+    of each project in LangSmith, along with the projects ranked by total tokens used.
+    """
+    names = [name.strip() for name in project_names.split(",") if name.strip()]
+    stats = project_stats.many_project_stats(names)
+    return json.dumps(dict(projects=stats, top_projects_by_tokens=top_projects(stats)))
+
+
+@tool("project_daily_tokens", args_schema=ProjectNameInput, return_direct=False)
+def project_daily_tokens(project_name):
+    """
+    This tool takes a project name and returns the runs and tokens used by that 
+    project in LangSmith on each of the last seven days.
+    """
+    return json.dumps(project_stats.daily_totals(project_name, days=7))
 
 
-def create_agent_executor(llm, tools, prompt):
+def create_agent_executor(llm, tools, prompt, store, agent_name):
     """
-    Creates a memory buffer and agent executor for an LLM.
+    Creates a bounded memory and agent executor for an LLM.
     :param llm: Initialized large language model
     :type llm: LangChain LLM object
     :param tools: List of LangChain tools
     :type tools: list
     :param prompt: Prompt for agent
     :type prompt: LangChain PromptTemplate
-    :return: Memory buffer for agent 
-    :rtype: ConversationMemoryBuffer
+    :param store: conversation history shared between agents
+    :type store: SharedConversationStore
+    :param agent_name: name the agent's answers are stored under
+    :type agent_name: str
+    :return: Memory for agent 
+    :rtype: BoundedSummaryMemory
     :return: Completed agent executor
     :rtype: AgentExecutor
     """
-    memory = ConversationBufferMemory(memory_key="history", input_key="input", return_messages=True)
-    # We need an input_key for memory so the buffer doesn't confuse what passed-in input is from the user.
+    # The memory fills the prompt's chat_history, keeping the user's input under input_key.
+    memory = BoundedSummaryMemory(store=store, agent_name=agent_name, memory_key="chat_history", input_key="input")
     agent = create_react_agent(llm, tools, prompt)
     executor = AgentExecutor(
             agent=agent, 
@@ -69,11 +106,66 @@ def create_agent_executor(llm, tools, prompt):
             memory=memory, 
             max_iterations=10, 
             early_stopping_method="generate", 
-            verbose=True
+            # Both agents run at once, so their steps are printed with labels by stream_agent instead.
+            verbose=False
     )
     return memory, executor
 
 
+async def stream_agent(agent_name, executor, agent_input) -> dict:
+    """
+    Runs an agent executor asynchronously, printing each thought, tool result and the final answer 
+    as soon as it is produced, labelled with the agent's name. An error is printed and returned
+    rather than raised, so one provider failing doesn't cancel the other agents.
+    :param agent_name: label printed before each line of output
+    :type agent_name: str
+    :param executor: agent executor to run
+    :type executor: AgentExecutor
+    :param agent_input: inputs for the executor
+    :type agent_input: dict
+    :return: latency in seconds, number of iterations, and the error if the agent failed
+    :rtype: dict
+    """
+    start = time.perf_counter()
+    iterations = 0
+    error = None
+    try:
+        async for chunk in executor.astream(agent_input):
+            for action in chunk.get("actions", []):
+                iterations += 1
+                print(f"\n[{agent_name}] {action.log.strip()}")
+            for step in chunk.get("steps", []):
+                print(f"\n[{agent_name}] Observation: {step.observation}")
+            if "output" in chunk:
+                # The step that produces the final answer counts as an iteration too.
+                iterations += 1
+                print(f"\n\n[{agent_name}] Final answer: \n\n{chunk['output']}")
+    except Exception as agent_error:
+        error = f"{type(agent_error).__name__}: {agent_error}"
+        print(f"\n\n[{agent_name}] Failed: {error}")
+
+    return dict(latency=time.perf_counter() - start, iterations=iterations, error=error)
+
+
+async def run_agents(agents, line) -> dict:
+    """
+    Runs every agent on the same query concurrently.
+    :param agents: map of agent name to agent executor
+    :type agents: dict
+    :param line: user query
+    :type line: str
+    :return: map of agent name to its stats from stream_agent
+    :rtype: dict
+    """
+    async with asyncio.TaskGroup() as tg:
+        tasks = {
+            agent_name: tg.create_task(stream_agent(agent_name, executor, {"input":line}))
+            for agent_name, executor in agents.items()
+        }
+
+    return {agent_name: task.result() for agent_name, task in tasks.items()}
+
+
 
 
 def main():
@@ -86,14 +178,17 @@ def main():
             HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE, 
         }
     )
-    gpt_llm = ChatOpenAI(model_name="gpt-4-turbo", temperature=0)
+    gpt_llm = ChatOpenAI(model_name="gpt-4-turbo", temperature=0, stream_usage=True)
 
 
     tools = load_tools(["terminal", "openweathermap-api"], allow_dangerous_tools=True)
-    tools.extend([project_token_info])
+    tools.extend([project_token_info, projects_token_summary, project_daily_tokens])
 
 
-    base_prompt = hub.pull("langchain-ai/react-agent-template")
+    # The pinned template loads from disk; set REFRESH_PROMPTS to update it from the hub for the next start.
+    if os.environ.get("REFRESH_PROMPTS"):
+        refresh_prompt("react-agent-template")
+    base_prompt = load_prompt("react-agent-template")
     final_prompt = base_prompt.partial(instructions="""When you use tools, you are allowed to use the response to craft a
         more specific answer. Your output to the user does not have to be the exact output of the tool.
         For the openweathermap-api tool, make sure your input corrects any spelling mistakes of location names.
@@ -101,13 +196,25 @@ def main():
         London
         Examples of bad inputs: Portland, OR
         L0ndon
-        For the project_token_info tool, make sure the string passed in doesn't have any extra characters
-        surrounding the project name the user gives. You are free to use the response from the tool to craft
+        For the project_token_info, projects_token_summary and project_daily_tokens tools, make sure the string passed in 
+        doesn't have any extra characters surrounding the project names the user gives. When the user asks about several 
+        projects, use projects_token_summary once instead of project_token_info for each project. You are free to use the response from the tool to craft
         a more human response.""")
 
 
-    gemini_memory, gemini_executor = create_agent_executor(gemini_llm, tools, final_prompt)
-    gpt_memory, gpt_executor = create_agent_executor(gpt_llm, tools, final_prompt)
+    # Both agents keep their history in one store; older turns are summarized by GPT in the background.
+    conversation_store = SharedConversationStore(
+            summarizer=gpt_llm, 
+            token_counter=gpt_llm.get_num_tokens, 
+            max_recent_turns=4, 
+            max_token_limit=1500
+    )
+    _, gemini_executor = create_agent_executor(gemini_llm, tools, final_prompt, conversation_store, "Gemini")
+    _, gpt_executor = create_agent_executor(gpt_llm, tools, final_prompt, conversation_store, "GPT")
+    agents = {
+        "Gemini": gemini_executor,
+        "GPT": gpt_executor,
+    }
 
 
     print("\nWelcome to my Gemini and GPT agents. The agent has access to these tools:\n")
@@ -115,24 +222,31 @@ def main():
         print(f'{tool.name}:  {tool.description}')
 
 
-    while True:
-        try:
-            line = input("\n\nEnter query (\"exit\" to end) >>  ")
-            if line and line != "exit": 
-                print("\n\nGemini's answer: \n")
-                result = gemini_executor.invoke({"input":line, "chat_history":gemini_memory})
-                print(f"\n\n{result.get('output')}")
+    # One event loop serves every query, so the async HTTP clients' pooled connections stay usable between queries.
+    with asyncio.Runner() as runner:
+        while True:
+            try:
+                line = input("\n\nEnter query (\"stats\" for latency, \"exit\" to end) >>  ")
+                if line == "stats":
+                    print_metrics(metrics)
+                    continue
+                if line and line != "exit": 
+                    start = time.perf_counter()
+                    stats = runner.run(run_agents(agents, line))
+                    time_taken = time.perf_counter() - start
 
-                print("\n\nGPT's answer: \n")
-                result = gpt_executor.invoke({"input":line, "chat_history":gpt_memory})
-                print(f"\n\n{result.get('output')}")
+                    print("\n")
+                    for agent_name, agent_stats in stats.items():
+                        outcome = f"failed ({agent_stats['error']})" if agent_stats["error"] else f"{agent_stats['iterations']} iterations"
+                        print(f"""{agent_name}: {"{:.2f}".format(agent_stats['latency'])} seconds, {outcome}.""")
+                    print(f"""Time taken to complete both agents: {"{:.2f}".format(time_taken)} seconds.""")
 
-            else:
-                break
+                else:
+                    break
 
-        except Exception:
-            traceback.print_exc()
-            break
+            except Exception:
+                traceback.print_exc()
+                break
     
     print("\nThanks for using the agent. Have a nice day!\n")
 
@@ -0,0 +1,169 @@
+from langchain_core.memory import BaseMemory
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from concurrent.futures import ThreadPoolExecutor
+from textwrap import dedent
+from typing import Any, Dict, List
+import traceback
+import threading
+
+
+SUMMARY_PROMPT = PromptTemplate.from_template(dedent("""
+    Progressively summarize the lines of conversation provided, adding onto the previous summary and returning a new summary.
+    Keep facts the user gave and any answers they may ask about again. Keep the summary under 150 words.
+
+    Current summary:
+    {summary}
+
+    New lines of conversation:
+    {new_lines}
+
+    New summary:"""))
+
+
+class SharedConversationStore:
+    """
+    Conversation history shared by several agents. Each user input is stored once, together with
+    every agent's answer to it, as plain strings. Turns older than the most recent ones are folded
+    into a running summary by a background thread.
+    :param summarizer: LLM used to update the summary
+    :type summarizer: LangChain LLM object
+    :param token_counter: function returning the number of tokens in a string
+    :type token_counter: Callable[[str], int]
+    :param max_recent_turns: turns kept verbatim before they are summarized
+    :type max_recent_turns: int
+    :param max_token_limit: token budget for the history given to an agent, summary included
+    :type max_token_limit: int
+    """
+    def __init__(self, summarizer, token_counter, max_recent_turns=4, max_token_limit=1500):
+        self.summary_chain = SUMMARY_PROMPT | summarizer | StrOutputParser()
+        self.token_counter = token_counter
+        self.max_recent_turns = max_recent_turns
+        self.max_token_limit = max_token_limit
+        # Each turn is [user input, {agent name: answer}].
+        self.turns = []
+        self.summary = ""
+        self.lock = threading.Lock()
+        self.summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+        self.summary_pending = False
+
+    def record(self, agent_name, user_input, output) -> None:
+        """
+        Stores an agent's answer, adding it to the open turn for the same input if there is one.
+        :param agent_name: name of the agent that answered
+        :type agent_name: str
+        :param user_input: the user's input
+        :type user_input: str
+        :param output: the agent's answer
+        :type output: str
+        """
+        with self.lock:
+            for turn in reversed(self.turns):
+                if turn[0] == user_input and agent_name not in turn[1]:
+                    turn[1][agent_name] = output
+                    break
+            else:
+                self.turns.append([user_input, {agent_name: output}])
+        self.schedule_summary()
+
+    def schedule_summary(self) -> None:
+        """
+        Starts summarizing the turns that have fallen out of the verbatim window, unless a summary
+        is already being written. The agents keep running in the meantime.
+        """
+        with self.lock:
+            end = len(self.turns) - self.max_recent_turns
+            if self.summary_pending or end <= 0:
+                return
+            self.summary_pending = True
+            summary = self.summary
+            new_turns = self.turns[:end]
+        self.summary_executor.submit(self.update_summary, summary, new_turns)
+
+    def update_summary(self, summary, new_turns) -> None:
+        """
+        Folds the oldest turns into the summary and deletes them. Runs on the summary thread.
+        :param summary: summary the turns are added onto
+        :type summary: str
+        :param new_turns: turns to add, the first turns of the history when the summary was scheduled
+        :type new_turns: list
+        """
+        new_lines = "\n".join(
+            f"Human: {user_input}\n" + "\n".join(f"{agent_name}: {output}" for agent_name, output in outputs.items())
+            for user_input, outputs in new_turns
+        )
+        try:
+            new_summary = self.summary_chain.invoke({"summary": summary, "new_lines": new_lines})
+        except Exception:
+            traceback.print_exc()
+            with self.lock:
+                self.summary_pending = False
+            return
+
+        with self.lock:
+            end = len(new_turns)
+            # Turns are only ever appended, so the summarized turns are still first unless the history was cleared.
+            if len(self.turns) >= end and all(turn is new_turn for turn, new_turn in zip(self.turns, new_turns)):
+                self.summary = new_summary.strip()
+                del self.turns[:end]
+            self.summary_pending = False
+        # More turns may have arrived while this summary was being written.
+        self.schedule_summary()
+
+    def history_for(self, agent_name) -> str:
+        """
+        Formats the history one agent sees: the summary, then as many of the latest unsummarized
+        turns as fit in the token budget, with that agent's own answers.
+        :param agent_name: name of the agent
+        :type agent_name: str
+        :return: conversation history text
+        :rtype: str
+        """
+        with self.lock:
+            summary = self.summary
+            turns = list(self.turns)
+
+        summary_text = f"Summary of earlier conversation: {summary}" if summary else ""
+        remaining = self.max_token_limit - (self.token_counter(summary_text) if summary_text else 0)
+        lines = []
+        for user_input, outputs in reversed(turns):
+            turn_text = f"Human: {user_input}\nAI: {outputs.get(agent_name, '')}"
+            remaining -= self.token_counter(turn_text)
+            if remaining < 0:
+                break
+            lines.insert(0, turn_text)
+
+        return "\n".join([summary_text] + lines if summary_text else lines)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.turns = []
+            self.summary = ""
+
+
+class BoundedSummaryMemory(BaseMemory):
+    """
+    One agent's view of a SharedConversationStore, used as an AgentExecutor's memory.
+    :param store: history shared with the other agents
+    :type store: SharedConversationStore
+    :param agent_name: name this agent's answers are stored under
+    :type agent_name: str
+    """
+    store: Any
+    agent_name: str
+    memory_key: str = "chat_history"
+    input_key: str = "input"
+    output_key: str = "output"
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        return {self.memory_key: self.store.history_for(self.agent_name)}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> None:
+        self.store.record(self.agent_name, inputs[self.input_key], outputs[self.output_key])
+
+    def clear(self) -> None:
+        self.store.clear()
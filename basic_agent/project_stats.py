@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+
+
+# Run fields daily_totals reads from LangSmith.
+DAILY_FIELDS = ["start_time", "prompt_tokens", "completion_tokens"]
+
+
+class ProjectStatsCache:
+    """
+    Caches LangSmith project token statistics for a limited time, and fetches statistics for
+    many projects concurrently. Any object with LangSmith's read_project and list_runs methods
+    can be used as the client, such as a Client pointed at a local stand-in with api_url.
+    :param client: LangSmith client
+    :type client: langsmith.Client
+    :param ttl_seconds: seconds a fetched result is reused for
+    :type ttl_seconds: float
+    :param max_workers: maximum concurrent requests to LangSmith
+    :type max_workers: int
+    """
+    def __init__(self, client, ttl_seconds=60, max_workers=8):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.max_workers = max_workers
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def cached(self, key, fetch):
+        """
+        Returns the stored value for a key if it hasn't expired, otherwise fetches and stores it.
+        :param key: cache key
+        :type key: tuple
+        :param fetch: function producing the value
+        :type fetch: Callable[[], Any]
+        :return: the cached or fetched value
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and now - entry[0] < self.ttl_seconds:
+            return entry[1]
+
+        value = fetch()
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+        return value
+
+    def project_stats(self, project_name) -> dict:
+        """
+        Gets run and token counts for one project.
+        :param project_name: name of a LangSmith project
+        :type project_name: str
+        :return: run count and prompt/completion token totals
+        :rtype: dict
+        """
+        def fetch():
+            results = self.client.read_project(project_name=project_name, include_stats=True)
+            return dict(
+                run_count=results.run_count or 0,
+                prompt_tokens_used=results.prompt_tokens or 0,
+                completion_tokens_generated=results.completion_tokens or 0,
+            )
+        return self.cached(("stats", project_name), fetch)
+
+    def many_project_stats(self, project_names) -> dict:
+        """
+        Gets run and token counts for several projects in one concurrent sweep. A project that
+        can't be read is reported with its error instead of failing the others.
+        :param project_names: names of LangSmith projects
+        :type project_names: list
+        :return: map of project name to stats, or to an error message
+        :rtype: dict
+        """
+        def fetch_or_error(project_name):
+            try:
+                return self.project_stats(project_name)
+            except Exception as error:
+                return dict(error=str(error))
+
+        unique_names = list(dict.fromkeys(project_names))
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(len(unique_names), 1))) as pool:
+            results = pool.map(fetch_or_error, unique_names)
+        return dict(zip(unique_names, results))
+
+    def daily_totals(self, project_name, days=7) -> list:
+        """
+        Adds up the tokens of a project's root runs for each of the last few days.
+        :param project_name: name of a LangSmith project
+        :type project_name: str
+        :param days: number of days to look back
+        :type days: int
+        :return: one entry per day with runs, prompt tokens and completion tokens, oldest first
+        :rtype: list
+        """
+        def fetch():
+            start_time = datetime.now(timezone.utc) - timedelta(days=days)
+            totals = {}
+            # Only the fields added up are downloaded, not each run's inputs and outputs.
+            runs = self.client.list_runs(project_name=project_name, is_root=True, start_time=start_time, select=DAILY_FIELDS)
+            for run in runs:
+                day = totals.setdefault(run.start_time.date().isoformat(), dict(runs=0, prompt_tokens=0, completion_tokens=0))
+                day["runs"] += 1
+                day["prompt_tokens"] += run.prompt_tokens or 0
+                day["completion_tokens"] += run.completion_tokens or 0
+            return [dict(date=date, **totals[date]) for date in sorted(totals)]
+        return self.cached(("daily", project_name, days), fetch)
+
+
+def top_projects(stats, limit=5) -> list:
+    """
+    Ranks projects by total tokens used, skipping any that couldn't be read.
+    :param stats: result of ProjectStatsCache.many_project_stats
+    :type stats: dict
+    :param limit: number of projects to return
+    :type limit: int
+    :return: project names with their total tokens, largest first
+    :rtype: list
+    """
+    totals = [
+        dict(project_name=project_name, total_tokens=project["prompt_tokens_used"] + project["completion_tokens_generated"])
+        for project_name, project in stats.items() if "error" not in project
+    ]
+    return sorted(totals, key=lambda project: project["total_tokens"], reverse=True)[:limit]
@@ -0,0 +1,81 @@
+from project_stats import ProjectStatsCache, top_projects, DAILY_FIELDS
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
+import unittest
+
+
+class FakeLangSmithClient:
+    """
+    Local stand-in for the LangSmith client, serving fixed projects and root runs and counting
+    every call made to it.
+    :param projects: map of project name to (run count, prompt tokens, completion tokens)
+    :type projects: dict
+    :param runs: map of project name to list of (start time, prompt tokens, completion tokens)
+    :type runs: dict
+    """
+    def __init__(self, projects, runs=None):
+        self.projects = projects
+        self.runs = runs or {}
+        self.calls = []
+
+    def read_project(self, project_name, include_stats=False):
+        self.calls.append(("read_project", project_name))
+        if project_name not in self.projects:
+            raise ValueError(f"Project {project_name} not found")
+        run_count, prompt_tokens, completion_tokens = self.projects[project_name]
+        return SimpleNamespace(run_count=run_count, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def list_runs(self, project_name, is_root=None, start_time=None, select=None):
+        self.calls.append(("list_runs", project_name, tuple(select or ())))
+        return [SimpleNamespace(start_time=start, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+                for start, prompt_tokens, completion_tokens in self.runs.get(project_name, [])
+                if start_time is None or start >= start_time]
+
+
+class ProjectStatsCacheTests(unittest.TestCase):
+    def test_stats_are_reused_until_the_ttl_expires(self):
+        client = FakeLangSmithClient({"alpha": (2, 10, 5)})
+        stats = ProjectStatsCache(client, ttl_seconds=60)
+        with mock.patch("project_stats.time.monotonic", return_value=1000.0):
+            first = stats.project_stats("alpha")
+            self.assertEqual(stats.project_stats("alpha"), first)
+        self.assertEqual(len(client.calls), 1)
+
+        with mock.patch("project_stats.time.monotonic", return_value=1061.0):
+            stats.project_stats("alpha")
+        self.assertEqual(len(client.calls), 2)
+        self.assertEqual(first, dict(run_count=2, prompt_tokens_used=10, completion_tokens_generated=5))
+
+    def test_unreadable_project_does_not_fail_the_others(self):
+        client = FakeLangSmithClient({"alpha": (1, 3, 4), "beta": (1, 1, 1)})
+        stats = ProjectStatsCache(client).many_project_stats(["alpha", "missing", "beta", "alpha"])
+        self.assertEqual(list(stats), ["alpha", "missing", "beta"])
+        self.assertIn("not found", stats["missing"]["error"])
+        self.assertEqual(stats["beta"]["prompt_tokens_used"], 1)
+
+    def test_top_projects_are_ordered_by_total_tokens(self):
+        client = FakeLangSmithClient({"small": (1, 5, 5), "large": (1, 100, 50), "medium": (1, 20, 30)})
+        stats = ProjectStatsCache(client).many_project_stats(["small", "large", "medium", "missing"])
+        ranked = top_projects(stats, limit=2)
+        self.assertEqual(ranked, [dict(project_name="large", total_tokens=150), dict(project_name="medium", total_tokens=50)])
+
+    def test_daily_totals_bucket_runs_by_day(self):
+        today = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+        yesterday = today - timedelta(days=1)
+        client = FakeLangSmithClient({}, runs={"alpha": [
+            (today, 10, 1),
+            (yesterday, 4, 2),
+            (today + timedelta(minutes=5), 5, None),
+            (today - timedelta(days=30), 1000, 1000),
+        ]})
+        totals = ProjectStatsCache(client).daily_totals("alpha", days=7)
+        self.assertEqual(totals, [
+            dict(date=yesterday.date().isoformat(), runs=1, prompt_tokens=4, completion_tokens=2),
+            dict(date=today.date().isoformat(), runs=2, prompt_tokens=15, completion_tokens=1),
+        ])
+        self.assertEqual(client.calls, [("list_runs", "alpha", tuple(DAILY_FIELDS))])
+
+
+if __name__ == "__main__":
+    unittest.main()
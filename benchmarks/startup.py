@@ -0,0 +1,90 @@
+from statistics import median
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Clients each app builds before its first prompt, whether at import or at the start of main().
+APP_CLIENTS = {
+    "async_chains": ["gemini", "openai"],
+    "basic_agent": ["gemini", "openai", "langsmith", "prompt"],
+    "deobfuscation_agent": ["gemini", "prompt"],
+    "ip_info_agent": ["openai"],
+    "political_info_rag": ["gemini", "openai"],
+}
+
+CLIENT_CONSTRUCTORS = {
+    "gemini": "from langchain_google_genai import GoogleGenerativeAI; GoogleGenerativeAI(model='gemini-1.5-pro-latest', temperature=0)",
+    "openai": "from langchain_openai import ChatOpenAI; ChatOpenAI(model='gpt-4o', temperature=0)",
+    "langsmith": "from langsmith import Client; Client()",
+    "prompt": "from common.prompt_registry import load_prompt; load_prompt('react-agent-template')",
+    "hub": "from langchain import hub; hub.pull('langchain-ai/react-agent-template')",
+}
+
+# Runs in a fresh interpreter inside the app's folder, printing the timings as JSON.
+MEASURE_SCRIPT = """
+import json, sys, time
+sys.path.append({root!r})
+start = time.perf_counter()
+import app
+timings = {{"import": time.perf_counter() - start}}
+for name, code in {constructors!r}.items():
+    start = time.perf_counter()
+    exec(code)
+    timings[name] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def measure_app(app_name, clients, runs) -> dict:
+    """
+    Times importing an app and constructing each of its clients, in a new process for every run
+    so import caches never carry over.
+    :param app_name: folder name of the app
+    :type app_name: str
+    :param clients: names from CLIENT_CONSTRUCTORS to construct after the import
+    :type clients: list
+    :param runs: number of processes to start
+    :type runs: int
+    :return: median seconds for the import and each client
+    :rtype: dict
+    """
+    environment = dict(os.environ)
+    # Placeholder keys let the clients construct without real credentials; nothing is sent.
+    environment.setdefault("GOOGLE_API_KEY", "benchmark")
+    environment.setdefault("OPENAI_API_KEY", "benchmark")
+    environment.setdefault("LANGCHAIN_API_KEY", "benchmark")
+    script = MEASURE_SCRIPT.format(root=REPOSITORY_ROOT, constructors={name: CLIENT_CONSTRUCTORS[name] for name in clients})
+
+    samples = []
+    for _ in range(runs):
+        completed_process = subprocess.run([sys.executable, "-c", script], cwd=os.path.join(REPOSITORY_ROOT, app_name),
+                                           env=environment, capture_output=True, text=True)
+        if completed_process.returncode != 0:
+            raise RuntimeError(f"{app_name} failed to start:\n{completed_process.stderr}")
+        samples.append(json.loads(completed_process.stdout.strip().splitlines()[-1]))
+
+    return {name: median(sample[name] for sample in samples) for name in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and client construction time for every app.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per app")
+    parser.add_argument("--include-hub", action="store_true", help="also time hub.pull for apps that load a prompt (needs network)")
+    args = parser.parse_args()
+
+    for app_name, clients in APP_CLIENTS.items():
+        if args.include_hub and "prompt" in clients:
+            clients = clients + ["hub"]
+        timings = measure_app(app_name, clients, args.runs)
+        total = sum(timings.values())
+        details = ", ".join(f"{name} {'{:.1f}'.format(seconds * 1000)} ms" for name, seconds in timings.items())
+        print(f"{app_name}: {'{:.1f}'.format(total * 1000)} ms total ({details})")
+
+
+if __name__ == "__main__":
+    main()
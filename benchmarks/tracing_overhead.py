@@ -0,0 +1,64 @@
+from langchain_core.language_models.fake import FakeListLLM
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+import tempfile
+import argparse
+import time
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tracing import configure_tracing
+
+
+# Tracing setups compared, as (label, mode, sample rate). Remote tracing needs LangSmith credentials.
+CONFIGURATIONS = [
+    ("off", "off", 1.0),
+    ("local, every trace", "local", 1.0),
+    ("local, 10% sampled", "local", 0.1),
+]
+
+
+def measure(chain, steps) -> float:
+    """
+    Invokes a chain repeatedly.
+    :param chain: LangChain chain to invoke
+    :type chain: RunnableSequence
+    :param steps: number of invocations
+    :type steps: int
+    :return: average seconds per invocation
+    :rtype: float
+    """
+    start = time.perf_counter()
+    for step in range(steps):
+        chain.invoke({"question": f"question {step}"})
+    return (time.perf_counter() - start) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-step overhead of each tracing mode on a fake LLM chain.")
+    parser.add_argument("--steps", type=int, default=2000, help="chain invocations per mode")
+    parser.add_argument("--include-remote", action="store_true", help="also measure LangSmith tracing (needs credentials and network)")
+    args = parser.parse_args()
+
+    configurations = CONFIGURATIONS + ([("remote", "remote", 1.0)] if args.include_remote else [])
+    # The fake LLM answers instantly, so the time measured is LangChain and tracing overhead only.
+    chain = PromptTemplate.from_template("Answer the question: {question}") | FakeListLLM(responses=["answer"]) | StrOutputParser()
+    os.environ["TRACE_FILE"] = os.path.join(tempfile.mkdtemp(), "runs.jsonl.gz")
+
+    baseline = None
+    for label, mode, sample_rate in configurations:
+        sink = configure_tracing("tracing-benchmark", mode=mode, sample_rate=sample_rate)
+        measure(chain, min(args.steps, 100))
+        per_step = measure(chain, args.steps)
+        if sink is not None:
+            sink.flush()
+        baseline = per_step if baseline is None else baseline
+        print(f"{label}: {'{:.1f}'.format(per_step * 1e6)} us per step ({'{:+.1f}'.format((per_step - baseline) * 1e6)} us vs off)")
+
+    configure_tracing("tracing-benchmark", mode="off")
+    print(f"\nLocal traces written to {os.environ['TRACE_FILE']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+from contextvars import ContextVar
+from collections import deque, namedtuple
+import threading
+import math
+import time
+import json
+import os
+
+
+# Only the most recent measurements are kept, so memory use stays fixed however long an app runs.
+DEFAULT_CAPACITY = 5000
+DEFAULT_METRICS_FILE = "./metrics.json"
+
+# Rough characters per token, used to estimate tokens for calls whose provider reports none, such as streamed Gemini calls.
+CHARACTERS_PER_TOKEN = 4
+
+# One finished run. Stage is "run" for a whole top-level request, or "llm", "tool", "retriever".
+# estimated_tokens is set when any of the tokens were estimated locally rather than reported by the provider.
+Measurement = namedtuple("Measurement", "stage name seconds first_token_seconds prompt_tokens completion_tokens iterations estimated_tokens")
+
+
+def percentile(sorted_values, fraction) -> float:
+    """
+    Nearest-rank percentile of values that are already sorted.
+    :param sorted_values: values in ascending order
+    :type sorted_values: list
+    :param fraction: percentile as a fraction, such as 0.95
+    :type fraction: float
+    :return: the percentile value
+    :rtype: float
+    """
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def token_usage(response) -> tuple:
+    """
+    Reads prompt and completion tokens from an LLM result, from the provider's llm_output or the
+    messages' usage metadata, whichever is present.
+    :param response: result passed to on_llm_end
+    :type response: LLMResult
+    :return: prompt tokens and completion tokens
+    :rtype: tuple
+    """
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt_tokens += metadata.get("input_tokens", 0)
+            completion_tokens += metadata.get("output_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+def estimate_tokens(characters) -> int:
+    """
+    Estimates the tokens in a number of characters of text, for providers that report no usage.
+    :param characters: length of the text
+    :type characters: int
+    :return: estimated tokens
+    :rtype: int
+    """
+    return math.ceil(characters / CHARACTERS_PER_TOKEN)
+
+
+class LatencyRecorder(BaseCallbackHandler):
+    """
+    Callback handler recording wall time for every top-level request and for each LLM call, tool
+    call and retrieval inside it, along with time to first token, token counts and agent iterations.
+    Measurements go into a fixed-size ring buffer.
+    :param capacity: number of measurements kept
+    :type capacity: int
+    """
+    # Called directly on the running thread, rather than handed to an executor for async runs.
+    run_inline = True
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.measurements = deque(maxlen=capacity)
+        # run id -> [stage, name, start, first token time, parent run id]
+        self.active = {}
+        # root run id -> [prompt tokens, completion tokens, iterations, any tokens estimated]
+        self.root_totals = {}
+        # LLM run id -> characters in its prompt, kept until the call ends in case its usage has to be estimated
+        self.prompt_characters = {}
+        self.lock = threading.Lock()
+
+    def start(self, stage, serialized, run_id, parent_run_id, kwargs) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name") or stage
+        with self.lock:
+            self.active[run_id] = [stage, name, time.perf_counter(), None, parent_run_id]
+            if parent_run_id is None:
+                self.root_totals[run_id] = [0, 0, 0, False]
+
+    def end(self, run_id, prompt_tokens=0, completion_tokens=0, estimated_tokens=False) -> None:
+        now = time.perf_counter()
+        with self.lock:
+            entry = self.active.pop(run_id, None)
+            if entry is None:
+                return
+            stage, name, start, first_token, parent_run_id = entry
+            first_token_seconds = first_token - start if first_token is not None else None
+
+            if parent_run_id is None:
+                totals = self.root_totals.pop(run_id, [0, 0, 0, False])
+                if stage == "chain":
+                    self.measurements.append(Measurement("run", name, now - start, None, *totals))
+                    return
+            else:
+                totals = self.root_totals.get(self.root_of(parent_run_id))
+                if totals is not None:
+                    totals[0] += prompt_tokens
+                    totals[1] += completion_tokens
+                    totals[3] = totals[3] or estimated_tokens
+
+            # An LLM or tool called on its own is both the whole run and its only stage.
+            if stage != "chain":
+                self.measurements.append(Measurement(stage, name, now - start, first_token_seconds, prompt_tokens, completion_tokens,
+                                                     None, estimated_tokens))
+
+    def root_of(self, run_id):
+        # Walks up through runs that are still active; called with the lock held.
+        while run_id in self.active and self.active[run_id][4] is not None:
+            run_id = self.active[run_id][4]
+        return run_id
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self.start("chain", serialized, run_id, parent_run_id, kwargs)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self.end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.end(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self.prompt_characters[run_id] = sum(len(prompt) for prompt in prompts)
+        self.start("llm", serialized, run_id, parent_run_id, kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self.prompt_characters[run_id] = sum(len(str(message.content)) for conversation in messages for message in conversation)
+        self.start("llm", serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        entry = self.active.get(run_id)
+        if entry is not None and entry[3] is None:
+            entry[3] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_characters = self.prompt_characters.pop(run_id, 0)
+        prompt_tokens, completion_tokens = token_usage(response)
+        if prompt_tokens or completion_tokens:
+            self.end(run_id, prompt_tokens, completion_tokens)
+            return
+        completion_characters = sum(len(generation.text) for generations in response.generations for generation in generations)
+        self.end(run_id, estimate_tokens(prompt_characters), estimate_tokens(completion_characters), estimated_tokens=True)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.prompt_characters.pop(run_id, None)
+        self.end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        self.start("tool", serialized, run_id, parent_run_id, kwargs)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self.end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.end(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self.start("retriever", serialized, run_id, parent_run_id, kwargs)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self.end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self.end(run_id)
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        with self.lock:
+            totals = self.root_totals.get(self.root_of(run_id))
+            if totals is not None:
+                totals[2] += 1
+
+    def summary(self) -> dict:
+        """
+        Summarizes the recorded measurements for each stage and name.
+        :return: map of "stage:name" to count, p50/p95/p99 seconds, time-to-first-token
+                 percentiles, token totals and mean iterations where recorded
+        :rtype: dict
+        """
+        with self.lock:
+            measurements = list(self.measurements)
+
+        groups = {}
+        for measurement in measurements:
+            groups.setdefault(f"{measurement.stage}:{measurement.name}", []).append(measurement)
+
+        summary = {}
+        for key, group in sorted(groups.items()):
+            seconds = sorted(measurement.seconds for measurement in group)
+            stats = dict(
+                count=len(group),
+                p50=percentile(seconds, 0.50),
+                p95=percentile(seconds, 0.95),
+                p99=percentile(seconds, 0.99),
+                prompt_tokens=sum(measurement.prompt_tokens for measurement in group),
+                completion_tokens=sum(measurement.completion_tokens for measurement in group),
+                estimated_tokens=any(measurement.estimated_tokens for measurement in group),
+            )
+            first_tokens = sorted(m.first_token_seconds for m in group if m.first_token_seconds is not None)
+            if first_tokens:
+                stats.update(first_token_p50=percentile(first_tokens, 0.50), first_token_p95=percentile(first_tokens, 0.95),
+                             first_token_p99=percentile(first_tokens, 0.99))
+            iterations = [measurement.iterations for measurement in group if measurement.iterations]
+            if iterations:
+                stats["mean_iterations"] = sum(iterations) / len(iterations)
+            summary[key] = stats
+        return summary
+
+    def report(self) -> str:
+        """
+        Formats the summary as a table for the REPL.
+        :return: one line per stage and name
+        :rtype: str
+        """
+        summary = self.summary()
+        if not summary:
+            return "No runs have been recorded yet."
+
+        lines = [f"{'stage:name':<45}{'count':>7}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'ttft p50':>10}{'tokens in/out':>17}"]
+        for key, stats in summary.items():
+            first_token = f"{stats['first_token_p50']:.2f}" if "first_token_p50" in stats else "-"
+            tokens = f"{'~' if stats['estimated_tokens'] else ''}{stats['prompt_tokens']}/{stats['completion_tokens']}"
+            line = f"{key[:44]:<45}{stats['count']:>7}{stats['p50']:>9.2f}{stats['p95']:>9.2f}{stats['p99']:>9.2f}{first_token:>10}{tokens:>17}"
+            if "mean_iterations" in stats:
+                line += f"   {stats['mean_iterations']:.1f} iterations"
+            lines.append(line)
+        if any(stats["estimated_tokens"] for stats in summary.values()):
+            lines.append(f"\n~ includes calls whose provider reported no usage, estimated at {CHARACTERS_PER_TOKEN} characters per token.")
+        return "\n".join(lines)
+
+    def export(self, file_path=None) -> str:
+        """
+        Writes the summary and the raw measurements as JSON. The path defaults to the
+        METRICS_FILE environment variable, then ./metrics.json.
+        :param file_path: file to write
+        :type file_path: str
+        :return: path of the written file
+        :rtype: str
+        """
+        file_path = file_path or os.environ.get("METRICS_FILE", DEFAULT_METRICS_FILE)
+        with self.lock:
+            measurements = [measurement._asdict() for measurement in self.measurements]
+        with open(file_path, "w") as file:
+            json.dump(dict(summary=self.summary(), measurements=measurements), file, indent=4)
+        return file_path
+
+
+# Installed like the local trace sink: the default of a context variable registered as a
+# configure hook, so every run in every thread reports to the same recorder.
+latency_recorder = None
+
+
+def install_instrumentation(capacity=DEFAULT_CAPACITY) -> LatencyRecorder:
+    """
+    Attaches a LatencyRecorder to every LangChain run in the process. Later calls return the
+    recorder installed by the first.
+    :param capacity: number of measurements kept
+    :type capacity: int
+    :return: the installed recorder
+    :rtype: LatencyRecorder
+    """
+    global latency_recorder
+    if latency_recorder is None:
+        latency_recorder = LatencyRecorder(capacity)
+        register_configure_hook(ContextVar("latency_recorder", default=latency_recorder), inheritable=True)
+    return latency_recorder
+
+
+def print_metrics(recorder) -> None:
+    """
+    Handles the REPL "stats" command: prints the latency summary and exports the metrics file.
+    :param recorder: recorder from install_instrumentation
+    :type recorder: LatencyRecorder
+    """
+    print(f"\n\n{recorder.report()}")
+    print(f"\nMetrics exported to {recorder.export()}")
@@ -0,0 +1,76 @@
+from langchain_core.prompts import PromptTemplate
+from functools import lru_cache
+import traceback
+import threading
+import tempfile
+import json
+import os
+
+
+# Pinned prompts are stored as JSON files in this folder, named after the prompt.
+PROMPT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+
+
+def prompt_path(name) -> str:
+    return os.path.join(PROMPT_DIRECTORY, f"{name}.json")
+
+
+@lru_cache(maxsize=None)
+def read_prompt_file(name) -> dict:
+    """
+    Reads the pinned copy of a prompt from disk. The result is cached for the life of the process.
+    :param name: prompt name, such as react-agent-template
+    :type name: str
+    :return: stored prompt fields
+    :rtype: dict
+    """
+    try:
+        with open(prompt_path(name), "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        raise ValueError(f"There is no pinned prompt named {name}.")
+
+
+def load_prompt(name) -> PromptTemplate:
+    """
+    Builds a prompt from its pinned copy, without any network access.
+    :param name: prompt name, such as react-agent-template
+    :type name: str
+    :return: prompt template, with any stored partial variables applied
+    :rtype: PromptTemplate
+    """
+    stored = read_prompt_file(name)
+    prompt = PromptTemplate.from_template(stored["template"])
+    return prompt.partial(**stored.get("partial_variables", {}))
+
+
+def refresh_prompt(name) -> threading.Thread:
+    """
+    Pulls the latest version of a pinned prompt from the LangChain hub in a background thread and 
+    replaces the pinned copy if the template changed. Prompts already loaded in this process are 
+    not affected; the new copy is used from the next start.
+    :param name: prompt name, such as react-agent-template
+    :type name: str
+    :return: the started thread
+    :rtype: threading.Thread
+    """
+    stored = read_prompt_file(name)
+
+    def pull_and_store():
+        try:
+            from langchain import hub
+            latest = hub.pull(stored["hub_name"])
+            if latest.template == stored["template"]:
+                return
+            updated = dict(stored, template=latest.template)
+            file_descriptor, temp_path = tempfile.mkstemp(dir=PROMPT_DIRECTORY, suffix=".tmp")
+            with os.fdopen(file_descriptor, "w") as file:
+                json.dump(updated, file, indent=4)
+                file.write("\n")
+            os.replace(temp_path, prompt_path(name))
+        except Exception:
+            traceback.print_exc()
+
+    thread = threading.Thread(target=pull_and_store, name=f"refresh-{name}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,166 @@
+from langchain_core.tracers.base import BaseTracer
+from langchain_core.tracers.context import register_configure_hook
+from contextvars import ContextVar
+import threading
+import random
+import atexit
+import gzip
+import json
+import os
+
+
+# TRACING_MODE picks where runs go: "remote" (LangSmith, the default), "local" (a compressed file) or "off".
+DEFAULT_TRACING_MODE = "remote"
+DEFAULT_TRACE_FILE = "./traces/runs.jsonl.gz"
+
+# The local sink writes when this many traces are waiting, or every FLUSH_INTERVAL seconds otherwise.
+BATCH_SIZE = 50
+FLUSH_INTERVAL = 5.0
+
+
+def serialize_run(run) -> dict:
+    """
+    Converts a finished run and its child runs into plain JSON-compatible values.
+    :param run: run recorded by a tracer
+    :type run: langchain_core.tracers.schemas.Run
+    :return: run fields, with child runs nested
+    :rtype: dict
+    """
+    return dict(
+        id=str(run.id),
+        trace_id=str(run.trace_id) if run.trace_id else None,
+        name=run.name,
+        run_type=run.run_type,
+        start_time=run.start_time.isoformat() if run.start_time else None,
+        end_time=run.end_time.isoformat() if run.end_time else None,
+        inputs=run.inputs,
+        outputs=run.outputs,
+        error=run.error,
+        tags=run.tags,
+        child_runs=[serialize_run(child) for child in run.child_runs],
+    )
+
+
+class LocalTraceSink(BaseTracer):
+    """
+    Tracer that keeps a sample of finished traces in memory and appends them in batches to a
+    gzip-compressed JSON lines file, from a background thread, instead of sending them to LangSmith.
+    Each batch is a separate gzip member, which gzip.open reads back as one continuous file.
+    :param project_name: project recorded with every trace
+    :type project_name: str
+    :param file_path: file traces are appended to
+    :type file_path: str
+    :param sample_rate: fraction of traces kept, from 0 to 1
+    :type sample_rate: float
+    """
+    def __init__(self, project_name, file_path=DEFAULT_TRACE_FILE, sample_rate=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.project_name = project_name
+        self.file_path = file_path
+        self.sample_rate = sample_rate
+        self.pending = []
+        self.lock = threading.Lock()
+        # Separate from lock, so traces can still be queued while a batch is being compressed.
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+        self.flusher = threading.Thread(target=self.flush_periodically, name="trace-flusher", daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def _persist_run(self, run) -> None:
+        # Only whole traces reach this point, so a trace is either kept entirely or dropped.
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        record = serialize_run(run)
+        record["project"] = self.project_name
+        with self.lock:
+            self.pending.append(record)
+            full = len(self.pending) >= BATCH_SIZE
+        if full:
+            self.wake.set()
+
+    def flush(self) -> None:
+        """
+        Appends all waiting traces to the trace file as one compressed batch.
+        """
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in batch)
+        with self.write_lock:
+            os.makedirs(os.path.dirname(self.file_path) or ".", exist_ok=True)
+            with gzip.open(self.file_path, "at") as file:
+                file.write(lines)
+
+    def flush_periodically(self) -> None:
+        while not self.stopped:
+            self.wake.wait(FLUSH_INTERVAL)
+            self.wake.clear()
+            self.flush()
+
+    def close(self) -> None:
+        """
+        Stops the background thread and writes any traces still waiting.
+        """
+        self.stopped = True
+        self.wake.set()
+        self.flusher.join(timeout=FLUSH_INTERVAL)
+        self.flush()
+
+
+# The local sink is created once and installed as the default of a context variable registered
+# as a configure hook, so LangChain adds it to the callbacks of every run in every thread without
+# it being passed through each call.
+local_sink = None
+local_sink_var = None
+
+
+def configure_tracing(project_name, mode=None, sample_rate=None):
+    """
+    Sets up tracing for an app. Mode and sample rate default to the TRACING_MODE and
+    TRACING_SAMPLE_RATE environment variables; TRACE_FILE sets where local traces are written.
+    :param project_name: LangSmith project, also recorded with local traces
+    :type project_name: str
+    :param mode: "remote", "local" or "off"
+    :type mode: str
+    :param sample_rate: fraction of traces kept, from 0 to 1
+    :type sample_rate: float
+    :return: the local sink when mode is "local", otherwise None
+    :rtype: LocalTraceSink | None
+    """
+    global local_sink, local_sink_var
+    mode = mode or os.environ.get("TRACING_MODE", DEFAULT_TRACING_MODE)
+    sample_rate = float(sample_rate if sample_rate is not None else os.environ.get("TRACING_SAMPLE_RATE", 1.0))
+    if mode not in ("remote", "local", "off"):
+        raise ValueError(f"Unknown tracing mode {mode}. Use remote, local or off.")
+
+    os.environ["LANGCHAIN_PROJECT"] = project_name
+    if mode == "remote":
+        os.environ["LANGCHAIN_TRACING_V2"] = "true"
+        os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
+        # The LangSmith client samples traces itself using this variable.
+        os.environ["LANGCHAIN_TRACING_SAMPLING_RATE"] = str(sample_rate)
+    else:
+        os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+    if mode != "local":
+        # Switching away from local tracing only detaches the sink in the current context.
+        if local_sink is not None:
+            local_sink_var.set(None)
+            local_sink.flush()
+        return None
+
+    file_path = os.environ.get("TRACE_FILE", DEFAULT_TRACE_FILE)
+    if local_sink is None:
+        local_sink = LocalTraceSink(project_name, file_path, sample_rate)
+        local_sink_var = ContextVar("local_trace_sink", default=local_sink)
+        register_configure_hook(local_sink_var, inheritable=True)
+    else:
+        local_sink.flush()
+        local_sink.project_name = project_name
+        local_sink.file_path = file_path
+        local_sink.sample_rate = sample_rate
+        local_sink_var.set(local_sink)
+    return local_sink
@@ -1,21 +1,34 @@
 from langchain_google_genai import GoogleGenerativeAI, HarmCategory, HarmBlockThreshold
 from langchain.agents import AgentExecutor, create_react_agent, load_tools
-from langsmith import Client
-from langchain import hub
 from langchain_core.pydantic_v1 import BaseModel, Field, validator
 from langchain.tools import tool
 from langchain_community.document_loaders.generic import GenericLoader
 from langchain_community.document_loaders.parsers import LanguageParser
+from langchain_community.document_loaders.blob_loaders import Blob
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import RunnablePassthrough
+from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.exceptions import OutputParserException
+from normalizer import normalize_code, NORMALIZER_VERSION
+from result_cache import content_hash, cache_key, get_cached_result, save_cached_result, NO_PREPROCESSING
 import traceback
+import tempfile
+import asyncio
+import json
 import os
 import re
+import sys
 
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
-os.environ["LANGCHAIN_PROJECT"] = f"gensec-hw4"
-os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
-client = Client()
+# Modules shared between the apps live in the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.prompt_registry import load_prompt, refresh_prompt
+from common.tracing import configure_tracing
+from common.instrumentation import install_instrumentation, print_metrics, estimate_tokens
+
+# Traces go to LangSmith unless TRACING_MODE=local (sampled, compressed file) or TRACING_MODE=off is set.
+configure_tracing("gensec-hw4")
+# Latency, time-to-first-token and token counts of every run, shown by the "stats" command.
+metrics = install_instrumentation()
 
 
 gemini_llm = GoogleGenerativeAI(
@@ -29,6 +42,13 @@ gemini_llm = GoogleGenerativeAI(
 )
 
 
+# Number of code segments sent to Gemini at the same time when deobfuscating a split file.
+MAX_CONCURRENT_SEGMENTS = 4
+
+# Comment prefixes LanguageParser uses for the placeholder lines left where functions and classes were cut out.
+PLACEHOLDER_PREFIXES = ("# Code for: ", "// Code for: ")
+
+
 class DocumentFilename(BaseModel):
     """
     This class enforces typechecking for a provided file name. 
@@ -53,13 +73,41 @@ class DocumentFilename(BaseModel):
         return result.group()
 
 
-def load_code(file_name) -> str:
+def normalize_blob(blob):
     """
-    Loads a file from current directory, parsing the file into code and returning it as a string.
+    Runs the local AST normalization pass over a Python blob, printing roughly how many tokens it
+    saved. Tokens are estimated locally, since counting them with Gemini is a request of its own.
+    Other languages are returned unchanged.
+    :param blob: Blob loaded from the filesystem
+    :type blob: Blob
+    :return: Blob with the normalized code
+    :rtype: Blob
+    """
+    if not str(blob.source).endswith(".py"):
+        return blob
+
+    report = normalize_code(blob.as_string())
+    if not report.changed:
+        return blob
+
+    original_tokens = estimate_tokens(len(report.original_code))
+    normalized_tokens = estimate_tokens(len(report.normalized_code))
+    print(f"\n\nLocal normalization removed ~{original_tokens - normalized_tokens} of ~{original_tokens} tokens "
+          f"({report.folded_expressions} expressions folded, {report.removed_branches} constant branches resolved, "
+          f"{report.removed_statements} dead statements removed).\n\n")
+    return Blob.from_data(report.normalized_code, path=blob.path, metadata=blob.metadata)
+
+
+def load_documents(file_name, normalize=True) -> list:
+    """
+    Loads a file from current directory, parsed by LanguageParser into top-level function/class 
+    documents followed by the remaining simplified code.
     :param file_name: name of a file, including extension.
     :type file_name: str
-    :return: string of code from loaded documents
-    :rtype: str
+    :param normalize: whether to strip bloat from Python code locally before parsing
+    :type normalize: bool
+    :return: list of Document objects
+    :rtype: list
     """
     loader = GenericLoader.from_filesystem(
             path=f"./{file_name}",
@@ -68,14 +116,93 @@ def load_code(file_name) -> str:
             parser=LanguageParser(),
     )
 
-    docs = loader.load()
+    docs = []
+    for blob in loader.blob_loader.yield_blobs():
+        if normalize:
+            blob = normalize_blob(blob)
+        docs.extend(loader.blob_parser.lazy_parse(blob))
     if not docs:
         raise ValueError("The filename was not found. Try again.")
+    return docs
+
 
+def load_code(file_name) -> str:
+    """
+    Loads a file from current directory, parsing the file into code and returning it as a string.
+    :param file_name: name of a file, including extension.
+    :type file_name: str
+    :return: string of code from loaded documents
+    :rtype: str
+    """
+    docs = load_documents(file_name)
     document_code = "\n\n\n".join([document.page_content for document in docs])
     return document_code
 
 
+def decorator_start(lines) -> int:
+    """
+    Finds where the decorators directly above a placeholder begin. LanguageParser cuts a function out
+    from its def line, leaving its decorators behind in the simplified code.
+    :param lines: simplified code lines before the placeholder
+    :type lines: list
+    :return: index of the first decorator line, or len(lines) if there are none
+    :rtype: int
+    """
+    start = len(lines)
+    for index in range(len(lines) - 1, -1, -1):
+        if not lines[index].strip():
+            break
+        # Lines below the first "@" are its arguments or further decorators.
+        if lines[index].lstrip().startswith("@"):
+            start = index
+    return start
+
+
+def split_segments(docs) -> list:
+    """
+    Rebuilds the original file order from LanguageParser documents as a list of segments: the 
+    simplified code between functions and classes, and each function or class, with its decorators,
+    in place of its placeholder.
+    :param docs: Documents from load_documents
+    :type docs: list
+    :return: code segments in file order, or an empty list if the file was not split
+    :rtype: list
+    """
+    functions_classes = [doc.page_content for doc in docs if doc.metadata.get("content_type") == "functions_classes"]
+    simplified = [doc.page_content for doc in docs if doc.metadata.get("content_type") == "simplified_code"]
+    if not functions_classes or len(simplified) != 1:
+        return []
+
+    segments = []
+    current_lines = []
+    next_function = 0
+    for line in simplified[0].splitlines():
+        stripped = line.lstrip()
+        is_placeholder = (
+            next_function < len(functions_classes)
+            and stripped.startswith(PLACEHOLDER_PREFIXES)
+            and stripped.endswith(functions_classes[next_function].splitlines()[0].strip())
+        )
+        if not is_placeholder:
+            current_lines.append(line)
+            continue
+        start = decorator_start(current_lines)
+        decorators = current_lines[start:]
+        current_lines = current_lines[:start]
+        if current_lines:
+            segments.append("\n".join(current_lines))
+            current_lines = []
+        segments.append("\n".join(decorators + [functions_classes[next_function]]))
+        next_function += 1
+
+    if current_lines:
+        segments.append("\n".join(current_lines))
+    # Every function must have been matched to its placeholder, otherwise the order can't be trusted.
+    if next_function != len(functions_classes):
+        return []
+    return segments
+
+
 def save_edited_file(file_prefix, file_name, code_contents) -> None:
     """
     Saves a new file in current directory, given a filename, prefix, and file contents.
@@ -93,38 +220,230 @@ def save_edited_file(file_prefix, file_name, code_contents) -> None:
     print(f"\n\nYour commented code has been saved to the following file: {new_filepath}\n\n")
 
 
-@tool("deobfuscate_code", args_schema=DocumentFilename, return_direct=True)
-def deobfuscate_code(file_name):
+# Bump a version whenever its prompts change, so cached results made with the old prompts are ignored.
+DEOBFUSCATION_PROMPT_VERSION = "2"
+COMMENT_PROMPT_VERSION = "1"
+
+# Bump SEGMENTING_VERSION whenever loading or splitting a file changes what is sent to Gemini.
+SEGMENTING_VERSION = "1"
+PIPELINE_VERSION = f"normalizer-{NORMALIZER_VERSION}:segments-{SEGMENTING_VERSION}"
+
+DEOBFUSCATION_PROMPT = PromptTemplate.from_template("""You are an intelligent AI code deobfuscation bot. 
+    Your directive is to take a piece of code and deobfuscate it, making it more understandable to 
+    the human programmer. Take each piece of deobfuscation step-by-step, so that the final result is 
+    a block of code that makes sense as a whole, and the purpose of the code is understandable. 
+    Improve any potentially confusing variable names with better, self-documenting names. 
+    MAKE SURE to move imports or includes to the top of the code.
+    Your final answer MUST be in code format - output only a string of code with no backticks.
+    Code content: {code_content}
+""")
+
+RENAME_PROMPT = PromptTemplate.from_template("""You are an intelligent AI code deobfuscation bot. 
+    Below is the top-level code of a file, followed by the first line of every function and class in it. 
+    Choose a better, self-documenting name for each confusing top-level function, class and global variable.
+    Your final answer MUST be a JSON object mapping each original name to its new name, with no backticks.
+    Top-level code: {skeleton}
+    Function and class declarations: {declarations}
+""")
+
+SEGMENT_PROMPT = PromptTemplate.from_template("""You are an intelligent AI code deobfuscation bot. 
+    Your directive is to take one segment of a larger file and deobfuscate it, making it more understandable to 
+    the human programmer. The other segments of the file are being deobfuscated separately, so only output 
+    the deobfuscated version of this segment and do not add code from elsewhere in the file. 
+    Improve any potentially confusing local variable names with better, self-documenting names. 
+    Top-level names MUST be renamed exactly as this JSON map says, everywhere they appear: {rename_map}
+    Your final answer MUST be in code format - output only a string of code with no backticks.
+    Code segment: {code_content}
+""")
+
+
+def plan_renames(docs) -> dict:
     """
-    Useful for retrieving code from a document in the filesystem and deobfuscating the code. Given a 
-    file name, the tool will retrieve the file and analyze the code inside of it, returning a string of 
-    deobfuscated code for the user to use. When the code is returned, it has been successfully deobfuscated.
+    Asks Gemini once for new names of the file's top-level symbols, so that segments deobfuscated
+    separately agree on what each function, class and global is called.
+    :param docs: Documents from load_documents
+    :type docs: list
+    :return: map of original name to new name, empty if the answer couldn't be parsed
+    :rtype: dict
+    """
+    skeleton = "\n".join(doc.page_content for doc in docs if doc.metadata.get("content_type") == "simplified_code")
+    declarations = "\n".join(doc.page_content.splitlines()[0] for doc in docs if doc.metadata.get("content_type") == "functions_classes")
+    rename_chain = RENAME_PROMPT | gemini_llm | JsonOutputParser()
+    try:
+        rename_map = rename_chain.invoke({"skeleton": skeleton, "declarations": declarations})
+    except OutputParserException:
+        return {}
+    return rename_map if isinstance(rename_map, dict) else {}
+
+
+async def deobfuscate_segments(segments, rename_map, output_path) -> str:
+    """
+    Deobfuscates segments concurrently, writing each one to a temporary file next to the output file
+    as soon as it and every segment before it have finished. The temporary file replaces the output
+    file once every segment is done and is deleted if any fails, so the output file is never left partial.
+    :param segments: code segments in file order
+    :type segments: list
+    :param rename_map: map of original top-level name to new name
+    :type rename_map: dict
+    :param output_path: path of the file to stream the deobfuscated code to
+    :type output_path: str
+    :return: deobfuscated code for the whole file
+    :rtype: str
+    """
+    segment_chain = SEGMENT_PROMPT | gemini_llm | StrOutputParser()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SEGMENTS)
+    rename_json = json.dumps(rename_map)
+
+    async def deobfuscate_segment(index, segment):
+        # Blank stretches between functions are kept as they are.
+        if not segment.strip():
+            return index, segment
+        async with semaphore:
+            result = await segment_chain.ainvoke({"code_content": segment, "rename_map": rename_json})
+        return index, result.strip("\n")
+
+    results = {}
+    next_to_write = 0
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".",
+                                                       prefix=f".{os.path.basename(output_path)}.", suffix=".partial")
+    try:
+        with os.fdopen(file_descriptor, "w") as file:
+            for task in asyncio.as_completed([deobfuscate_segment(index, segment) for index, segment in enumerate(segments)]):
+                index, result = await task
+                results[index] = result
+                while next_to_write in results:
+                    file.write(results[next_to_write] + "\n")
+                    file.flush()
+                    next_to_write += 1
+        os.replace(temporary_path, output_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+    return "\n".join(results[index] for index in range(len(segments)))
+
+
+COMMENT_PROMPT = PromptTemplate.from_template("""You are an intelligent AI code commenting bot. 
+    Your directive is to take in a section of code and add documentation docstrings to it in the Google format.
+    Here are the rules to commenting:
+    1. Your comments must be using the Google arg/return style for each programming language.
+    2. You may only add comments to function declarations and class/enum declarations. No inline comments, and no constructor comments.
+    3. Include Google-style format documentation for arguments and returns of each function.
+    4. Do NOT remove any code from the original - only add comments to the final result. 
+    5. Move all imports or includes to the top of the resulting code.
+    6. Your final answer MUST be in code format - output only a string of code with NO BACKTICKS surrounding it. 
+    Try this step-by-step and review the rules to make sure you follow them.
+    Code content: {code_content}
+""")
+
+
+def read_source_hash(file_name) -> str:
+    """
+    Hashes the raw contents of a file in the current directory, for use in result cache keys.
+    :param file_name: name of a file, including extension.
+    :type file_name: str
+    :return: hex digest of the file contents
+    :rtype: str
+    """
+    try:
+        with open(f"./{file_name}", "rb") as file:
+            return content_hash(file.read())
+    except (FileNotFoundError, IsADirectoryError):
+        raise ValueError("The filename was not found. Try again.")
+
+
+def run_deobfuscation(file_name) -> str:
+    """
+    Deobfuscates a file with Gemini and writes the result to deobfuscated_<file_name>. Files split 
+    into several segments are deobfuscated in parallel and streamed to the output file.
     :param file_name: filename without path, with extension.
     :type file_name: str
-    :return: modified deobfuscated code
+    :return: deobfuscated code
     :rtype: str
     """
+    docs = load_documents(file_name)
+    segments = split_segments(docs)
+
+    # Files that LanguageParser couldn't split into functions are deobfuscated in one request.
+    if len(segments) < 2:
+        document_code = "\n\n\n".join([document.page_content for document in docs])
+        deobfuscation_chain = ({"code_content":RunnablePassthrough()} | DEOBFUSCATION_PROMPT | gemini_llm)
+        final_code = deobfuscation_chain.invoke(document_code)
+        save_edited_file("deobfuscated_", file_name, final_code)
+        return final_code
+
+    rename_map = plan_renames(docs)
+    final_code = asyncio.run(deobfuscate_segments(segments, rename_map, f"./deobfuscated_{file_name}"))
+    print(f"\n\nYour deobfuscated code has been saved to the following file: ./deobfuscated_{file_name}\n\n")
+    return final_code
 
-    document_code = load_code(file_name)
 
-    prompt = PromptTemplate.from_template("""You are an intelligent AI code deobfuscation bot. 
-        Your directive is to take a piece of code and deobfuscate it, making it more understandable to 
-        the human programmer. Take each piece of deobfuscation step-by-step, so that the final result is 
-        a block of code that makes sense as a whole, and the purpose of the code is understandable. 
-        Improve any potentially confusing variable names with better, self-documenting names. 
-        MAKE SURE to move imports or includes to the top of the code.
-        Your final answer MUST be in code format - output only a string of code with no backticks.
-        Code content: {code_content}
-    """)
+def comment_source(code) -> str:
+    """
+    Adds documentation comments to a string of code with Gemini.
+    :param code: string of code
+    :type code: str
+    :return: code with comments
+    :rtype: str
+    """
+    commenting_chain = ({"code_content":RunnablePassthrough()} | COMMENT_PROMPT | gemini_llm)
+    return commenting_chain.invoke(code)
 
-    deobfuscation_chain = ({"code_content":RunnablePassthrough()} | prompt | gemini_llm)
-    final_code = deobfuscation_chain.invoke(document_code)
 
-    save_edited_file("deobfuscated_", file_name, final_code)
+def cached_deobfuscation(file_name) -> str:
+    """
+    Returns the deobfuscated code for a file, reusing the stored result when the file and prompts 
+    haven't changed since it was last deobfuscated.
+    :param file_name: filename without path, with extension.
+    :type file_name: str
+    :return: deobfuscated code
+    :rtype: str
+    """
+    key = cache_key(read_source_hash(file_name), "deobfuscate_code", DEOBFUSCATION_PROMPT_VERSION, PIPELINE_VERSION)
+    final_code = get_cached_result(key)
+    if final_code is not None:
+        save_edited_file("deobfuscated_", file_name, final_code)
+        return final_code
+
+    final_code = run_deobfuscation(file_name)
+    save_cached_result(key, final_code)
+    return final_code
+
 
+def cached_comments(source_hash, load_source, pipeline_version) -> str:
+    """
+    Returns commented code, reusing the stored result for code with the same hash.
+    :param source_hash: hash of the code to comment
+    :type source_hash: str
+    :param load_source: function returning the code to comment, only called on a cache miss
+    :type load_source: Callable[[], str]
+    :param pipeline_version: version of the preprocessing load_source applies to the hashed code
+    :type pipeline_version: str
+    :return: code with comments
+    :rtype: str
+    """
+    key = cache_key(source_hash, "comment_code", COMMENT_PROMPT_VERSION, pipeline_version)
+    final_code = get_cached_result(key)
+    if final_code is None:
+        final_code = comment_source(load_source())
+        save_cached_result(key, final_code)
     return final_code
 
 
+@tool("deobfuscate_code", args_schema=DocumentFilename, return_direct=True)
+def deobfuscate_code(file_name):
+    """
+    Useful for retrieving code from a document in the filesystem and deobfuscating the code. Given a 
+    file name, the tool will retrieve the file and analyze the code inside of it, returning a string of 
+    deobfuscated code for the user to use. When the code is returned, it has been successfully deobfuscated.
+    :param file_name: filename without path, with extension.
+    :type file_name: str
+    :return: modified deobfuscated code
+    :rtype: str
+    """
+    return cached_deobfuscation(file_name)
+
+
 @tool("comment_code", args_schema=DocumentFilename, return_direct=True)
 def comment_code(file_name) -> str:
     """
@@ -135,27 +454,24 @@ def comment_code(file_name) -> str:
     :return: modified code with comments
     :rtype: str
     """
-
-    document_code = load_code(file_name)
-
-    prompt = PromptTemplate.from_template("""You are an intelligent AI code commenting bot. 
-        Your directive is to take in a section of code and add documentation docstrings to it in the Google format.
-        Here are the rules to commenting:
-        1. Your comments must be using the Google arg/return style for each programming language.
-        2. You may only add comments to function declarations and class/enum declarations. No inline comments, and no constructor comments.
-        3. Include Google-style format documentation for arguments and returns of each function.
-        4. Do NOT remove any code from the original - only add comments to the final result. 
-        5. Move all imports or includes to the top of the resulting code.
-        6. Your final answer MUST be in code format - output only a string of code with NO BACKTICKS surrounding it. 
-        Try this step-by-step and review the rules to make sure you follow them.
-        Code content: {code_content}
-    """)
-
-    commenting_chain = ({"code_content":RunnablePassthrough()} | prompt | gemini_llm)
-    final_code = commenting_chain.invoke(document_code)
-
+    final_code = cached_comments(read_source_hash(file_name), lambda: load_code(file_name), PIPELINE_VERSION)
     save_edited_file("commented_", file_name, final_code)
+    return final_code
+
 
+@tool("deobfuscate_and_comment_code", args_schema=DocumentFilename, return_direct=True)
+def deobfuscate_and_comment_code(file_name) -> str:
+    """
+    Use this tool when the user wants code both deobfuscated and commented. Given a file name, the tool 
+    deobfuscates the code in it and then adds comments to the deobfuscated result, returning the final code.
+    :param file_name: filename without path, with extension.
+    :type file_name: str
+    :return: deobfuscated code with comments
+    :rtype: str
+    """
+    deobfuscated_code = cached_deobfuscation(file_name)
+    final_code = cached_comments(content_hash(deobfuscated_code), lambda: deobfuscated_code, NO_PREPROCESSING)
+    save_edited_file("commented_deobfuscated_", file_name, final_code)
     return final_code
 
 
@@ -164,13 +480,16 @@ def comment_code(file_name) -> str:
 
 
 def main():
-    base_prompt = hub.pull("langchain-ai/react-agent-template")
+    # The pinned template loads from disk; set REFRESH_PROMPTS to update it from the hub for the next start.
+    if os.environ.get("REFRESH_PROMPTS"):
+        refresh_prompt("react-agent-template")
+    base_prompt = load_prompt("react-agent-template")
     prompt = base_prompt.partial(instructions="""You are an agent that is used for helping the user deobfuscate and comment code.
         Be as helpful as possible. If you are unable to produce an answer that is helpful to the user, say so.
         The user is allowed to look up information related to programming and deobfuscation ONLY. Deny them in any other case.""")
 
     tools = load_tools(["serpapi"])
-    tools.extend([deobfuscate_code, comment_code])
+    tools.extend([deobfuscate_code, comment_code, deobfuscate_and_comment_code])
 
     gemini_agent = create_react_agent(gemini_llm, tools, prompt)
     gemini_executor = AgentExecutor(
@@ -187,7 +506,10 @@ def main():
 
     while True:
         try:
-            line = input("\n\nEnter query (\"exit\" to end) >>  ")
+            line = input("\n\nEnter query (\"stats\" for latency, \"exit\" to end) >>  ")
+            if line == "stats":
+                print_metrics(metrics)
+                continue
             if line and line != "exit": 
                 result = gemini_executor.invoke({"input":line})
                 print(f"\n\n{result.get('output')}")
@@ -0,0 +1,223 @@
+from concurrent.futures import ProcessPoolExecutor
+from langchain_core.output_parsers import StrOutputParser
+from app import gemini_llm, DEOBFUSCATION_PROMPT, DEOBFUSCATION_PROMPT_VERSION, COMMENT_PROMPT, COMMENT_PROMPT_VERSION
+from normalizer import normalize_code, NORMALIZER_VERSION
+from result_cache import content_hash, cache_key, get_cached_result, save_cached_result, write_atomically, NO_PREPROCESSING
+import traceback
+import argparse
+import asyncio
+import json
+import time
+import os
+
+
+SUPPORTED_SUFFIXES = (".py", ".txt", ".cpp")
+
+# Files already processed are recorded here, inside the output folder, so an interrupted run can resume.
+MANIFEST_NAME = ".batch_manifest.jsonl"
+
+# Batch runs send each normalized file whole, unlike the agent, which splits it into segments.
+PIPELINE_VERSION = f"normalizer-{NORMALIZER_VERSION}:whole-file"
+
+OUTPUT_PREFIXES = {
+    "deobfuscate": "deobfuscated_",
+    "comment": "commented_",
+    "both": "commented_deobfuscated_",
+}
+
+
+def find_source_files(directory) -> list:
+    """
+    Walks a directory for code files the agent can process.
+    :param directory: folder to search
+    :type directory: str
+    :return: paths of matching files, relative to the folder, sorted
+    :rtype: list
+    """
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(SUPPORTED_SUFFIXES):
+                paths.append(os.path.relpath(os.path.join(root, name), directory))
+    return sorted(paths)
+
+
+def prepare_file(path) -> tuple:
+    """
+    Reads and hashes one file and runs the local normalization pass on Python code. Runs in a
+    worker process, so it only takes and returns plain values.
+    :param path: path of the file
+    :type path: str
+    :return: hash of the raw file and the code to send to the LLM
+    :rtype: tuple
+    """
+    with open(path, "rb") as file:
+        raw = file.read()
+    code = raw.decode("utf-8", errors="replace")
+    if path.endswith(".py"):
+        code = normalize_code(code).normalized_code
+    return content_hash(raw), code
+
+
+def read_file_hash(path) -> str:
+    """
+    Hashes the raw contents of a file, to check it against the manifest before preparing it.
+    :param path: path of the file
+    :type path: str
+    :return: hex digest of the file contents
+    :rtype: str
+    """
+    with open(path, "rb") as file:
+        return content_hash(file.read())
+
+
+def load_manifest(output_directory) -> set:
+    """
+    Reads the (path, hash, task) entries of files finished by earlier runs.
+    :param output_directory: folder holding the outputs and manifest
+    :type output_directory: str
+    :return: finished entries
+    :rtype: set
+    """
+    finished = set()
+    try:
+        with open(os.path.join(output_directory, MANIFEST_NAME), "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                    finished.add((entry["path"], entry["hash"], entry["task"]))
+                except (json.JSONDecodeError, KeyError):
+                    # A line cut short by an interruption is simply redone.
+                    continue
+    except FileNotFoundError:
+        pass
+    return finished
+
+
+async def run_cached(chain, code, key) -> str:
+    """
+    Invokes a chain on code unless a result for the key is already stored.
+    :param chain: LangChain chain taking code_content
+    :type chain: RunnableSequence
+    :param code: code to send
+    :type code: str
+    :param key: key from cache_key
+    :type key: str
+    :return: chain output
+    :rtype: str
+    """
+    result = get_cached_result(key)
+    if result is None:
+        result = await chain.ainvoke({"code_content": code})
+        save_cached_result(key, result)
+    return result
+
+
+async def process_file(relative_path, prepared, task, output_directory, semaphore, manifest) -> None:
+    """
+    Sends one prepared file to Gemini and writes the result atomically into the output folder.
+    :param relative_path: path of the file relative to the input folder
+    :type relative_path: str
+    :param prepared: future resolving to the hash and code from prepare_file
+    :type prepared: asyncio.Future
+    :param task: "deobfuscate", "comment" or "both"
+    :type task: str
+    :param output_directory: folder to write results into
+    :type output_directory: str
+    :param semaphore: limits how many files are with the LLM at once
+    :type semaphore: asyncio.Semaphore
+    :param manifest: open manifest file to record the finished file in
+    :type manifest: TextIO
+    """
+    source_hash, code = await prepared
+
+    deobfuscation_chain = DEOBFUSCATION_PROMPT | gemini_llm | StrOutputParser()
+    commenting_chain = COMMENT_PROMPT | gemini_llm | StrOutputParser()
+
+    async with semaphore:
+        if task in ("deobfuscate", "both"):
+            code = await run_cached(deobfuscation_chain, code,
+                                    cache_key(source_hash, "deobfuscate_code", DEOBFUSCATION_PROMPT_VERSION, PIPELINE_VERSION))
+        if task in ("comment", "both"):
+            # Commenting after deobfuscation is keyed on the deobfuscated code, matching the agent's tools.
+            if task == "comment":
+                comment_key = cache_key(source_hash, "comment_code", COMMENT_PROMPT_VERSION, PIPELINE_VERSION)
+            else:
+                comment_key = cache_key(content_hash(code), "comment_code", COMMENT_PROMPT_VERSION, NO_PREPROCESSING)
+            code = await run_cached(commenting_chain, code, comment_key)
+
+    directory, name = os.path.split(relative_path)
+    write_atomically(os.path.join(output_directory, directory, f"{OUTPUT_PREFIXES[task]}{name}"), code)
+    manifest.write(json.dumps({"path": relative_path, "hash": source_hash, "task": task}) + "\n")
+    manifest.flush()
+
+
+async def run_batch(input_directory, output_directory, task, workers, concurrency) -> None:
+    """
+    Processes every supported file in a folder: local preprocessing in a process pool, then
+    Gemini requests with bounded concurrency. Files recorded in the manifest with an unchanged
+    hash are skipped before they reach the process pool.
+    :param input_directory: folder of code files
+    :type input_directory: str
+    :param output_directory: folder to write results into
+    :type output_directory: str
+    :param task: "deobfuscate", "comment" or "both"
+    :type task: str
+    :param workers: number of preprocessing processes
+    :type workers: int
+    :param concurrency: maximum files sent to the LLM at once
+    :type concurrency: int
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    finished = load_manifest(output_directory)
+    relative_paths = find_source_files(input_directory)
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    processed = skipped = failed = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            open(os.path.join(output_directory, MANIFEST_NAME), "a") as manifest:
+        jobs = {}
+        for relative_path in relative_paths:
+            path = os.path.join(input_directory, relative_path)
+            try:
+                if (relative_path, read_file_hash(path), task) in finished:
+                    skipped += 1
+                    continue
+            except OSError:
+                # Left to prepare_file, so the failure is reported with the others.
+                pass
+            prepared = loop.run_in_executor(pool, prepare_file, path)
+            jobs[relative_path] = asyncio.create_task(
+                    process_file(relative_path, prepared, task, output_directory, semaphore, manifest))
+
+        for relative_path, job in jobs.items():
+            try:
+                await job
+                processed += 1
+            except Exception:
+                failed += 1
+                print(f"\n\nFailed to process {relative_path}:")
+                traceback.print_exc()
+
+    time_taken = time.perf_counter() - start
+    print(f"\n\nProcessed {processed} files, skipped {skipped} already finished, {failed} failed. "
+          f"Time taken: {'{:.2f}'.format(time_taken)} seconds.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deobfuscate and/or comment every code file in a folder.")
+    parser.add_argument("input_directory", help="folder of code files to process")
+    parser.add_argument("--output-directory", help="folder for results (default: <input_directory>_output)")
+    parser.add_argument("--task", choices=OUTPUT_PREFIXES.keys(), default="deobfuscate")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes used for local preprocessing")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum files sent to Gemini at once")
+    args = parser.parse_args()
+
+    output_directory = args.output_directory or f"{args.input_directory.rstrip(os.sep)}_output"
+    asyncio.run(run_batch(args.input_directory, output_directory, args.task, args.workers, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
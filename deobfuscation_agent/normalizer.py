@@ -0,0 +1,558 @@
+import ast
+import base64
+import binascii
+import operator
+import re
+from dataclasses import dataclass
+
+
+# Folded constants larger than this are left as expressions, so folding never inflates the prompt.
+MAX_FOLDED_LENGTH = 10000
+
+# Folded integers larger than this many bits are left as expressions; ast.unparse refuses very long integers.
+MAX_FOLDED_BITS = 4096
+
+# Passes over the tree stop early once a pass makes no changes.
+MAX_PASSES = 10
+
+# Bumped whenever a change to normalization can change the code sent to the LLM, so cached results are not reused.
+NORMALIZER_VERSION = "3"
+
+# Width and precision of each %-format specifier, which decide how long the formatted result can get.
+FORMAT_SPECIFIER = re.compile(r"%(?:\([^)]*\))?[-#0 +]*(\*|\d*)(?:\.(\*|\d*))?")
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_,
+    ast.BitAnd: operator.and_,
+    ast.BitXor: operator.xor,
+}
+
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+    ast.Invert: operator.invert,
+}
+
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda left, right: left in right,
+    ast.NotIn: lambda left, right: left not in right,
+}
+
+# Statements that end a block; anything after them in the same block can never run.
+TERMINATORS = (ast.Return, ast.Raise, ast.Continue, ast.Break)
+
+# Nodes that change the function around them even if they never run, so code holding them is never dropped.
+SCOPE_NODES = (ast.Yield, ast.YieldFrom, ast.Global, ast.Nonlocal)
+
+# Builtins that read variables by name at runtime, so no assignment can be proven unused in a file calling them.
+DYNAMIC_LOOKUPS = {"exec", "eval", "globals", "locals", "vars"}
+
+
+@dataclass
+class NormalizationReport:
+    """
+    Result of normalizing one piece of source code.
+    :param original_code: code before normalization
+    :type original_code: str
+    :param normalized_code: code after normalization, or the original if it couldn't be parsed
+    :type normalized_code: str
+    :param folded_expressions: constant expressions replaced by their value
+    :type folded_expressions: int
+    :param removed_branches: if/while statements with a constant condition that were resolved
+    :type removed_branches: int
+    :param removed_statements: unreachable statements and unused constant assignments removed
+    :type removed_statements: int
+    """
+    original_code: str
+    normalized_code: str
+    folded_expressions: int = 0
+    removed_branches: int = 0
+    removed_statements: int = 0
+
+    @property
+    def changed(self) -> bool:
+        return self.normalized_code != self.original_code
+
+
+def is_constant(node) -> bool:
+    return isinstance(node, ast.Constant)
+
+
+def small_enough(value) -> bool:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value.bit_length() <= MAX_FOLDED_BITS
+    return not isinstance(value, (str, bytes)) or len(value) <= MAX_FOLDED_LENGTH
+
+
+def format_small_enough(template) -> bool:
+    """
+    Checks that %-formatting a template can't produce a huge string, before it is evaluated.
+    :param template: left operand of %
+    :type template: str | bytes
+    :return: False when any width or precision is too large or is taken from the arguments
+    :rtype: bool
+    """
+    if isinstance(template, bytes):
+        template = template.decode("latin-1")
+    for width, precision in FORMAT_SPECIFIER.findall(template):
+        for part in (width, precision):
+            if part == "*" or (part and (len(part) > 6 or int(part) > MAX_FOLDED_LENGTH)):
+                return False
+    return True
+
+
+def affects_scope(nodes) -> bool:
+    """
+    Checks whether statements or expressions contain yield, which makes the function around them
+    a generator, or global/nonlocal, which changes where its names live. Either applies even when
+    the code never runs. Nested functions, lambdas and classes are not looked into.
+    :param nodes: AST nodes to search
+    :type nodes: list
+    :rtype: bool
+    """
+    pending = list(nodes)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, SCOPE_NODES):
+            return True
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            pending.extend(ast.iter_child_nodes(node))
+    return False
+
+
+def collect_bindings(tree) -> tuple:
+    """
+    Finds how often every name is bound and loaded anywhere in the module. Scopes are not
+    tracked, so a name bound in any function counts against the module-level name as well.
+    Augmented assignments, del, and global/nonlocal declarations count as loads too, since each
+    needs an existing binding.
+    :param tree: parsed module
+    :type tree: ast.Module
+    :return: map of name to binding count, and set of names that are loaded
+    :rtype: tuple
+    """
+    bindings = {}
+    loads = set()
+
+    def bind(name):
+        bindings[name] = bindings.get(name, 0) + 1
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, (ast.Load, ast.Del)):
+                loads.add(node.id)
+            if not isinstance(node.ctx, ast.Load):
+                bind(node.id)
+        elif isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name):
+            loads.add(node.target.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bind(node.name)
+        elif isinstance(node, ast.arg):
+            bind(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                bind((alias.asname or alias.name).split(".")[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            for name in node.names:
+                # Assignments through global statements can't be followed, so the name is never constant.
+                bind(name)
+                bind(name)
+                loads.add(name)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bind(node.name)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            bind(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            bind(node.rest)
+    return bindings, loads
+
+
+def find_constant_names(tree) -> dict:
+    """
+    Finds module-level names assigned exactly once to a constant and never rebound, such as
+    the character tables used to spell out strings one index at a time.
+    :param tree: parsed module
+    :type tree: ast.Module
+    :return: map of name to constant value
+    :rtype: dict
+    """
+    bindings, _ = collect_bindings(tree)
+    constants = {}
+    for statement in tree.body:
+        if (isinstance(statement, ast.Assign) and len(statement.targets) == 1
+                and isinstance(statement.targets[0], ast.Name) and is_constant(statement.value)):
+            name = statement.targets[0].id
+            if bindings.get(name) == 1:
+                constants[name] = statement.value.value
+    return constants
+
+
+def imported_modules(tree) -> set:
+    """
+    Finds modules imported under their own name, whose functions can be evaluated safely.
+    :param tree: parsed module
+    :type tree: ast.Module
+    :return: names of modules imported without an alias
+    :rtype: set
+    """
+    return {alias.name for node in ast.walk(tree) if isinstance(node, ast.Import)
+            for alias in node.names if alias.asname is None}
+
+
+class ConstantFolder(ast.NodeTransformer):
+    """
+    Replaces expressions built only from constants with their value, including indexing into
+    constant string tables, chr()/ord() chains, str.join over constant strings and base64/hex decoding.
+    :param constants: module-level names with a known constant value
+    :type constants: dict
+    :param modules: modules imported without an alias
+    :type modules: set
+    :param bindings: map of name to binding count, from collect_bindings
+    :type bindings: dict
+    """
+    def __init__(self, constants, modules, bindings):
+        self.constants = constants
+        self.modules = modules
+        self.bindings = bindings
+        self.folded = 0
+
+    def is_builtin(self, node, name) -> bool:
+        # A builtin the file defines or assigns itself can't be evaluated for it.
+        return isinstance(node, ast.Name) and node.id == name and name not in self.bindings
+
+    def is_module(self, node, name) -> bool:
+        # The module must be imported under its own name and never rebound.
+        return (isinstance(node, ast.Name) and node.id == name and name in self.modules
+                and self.bindings.get(name) == 1)
+
+    def replace(self, node, value):
+        if not small_enough(value):
+            return node
+        self.folded += 1
+        return ast.copy_location(ast.Constant(value=value), node)
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        operation = BINARY_OPERATORS.get(type(node.op))
+        if operation and is_constant(node.left) and is_constant(node.right):
+            left, right = node.left.value, node.right.value
+            # Repetition is checked before evaluating, so "x" * 10**9 is never built.
+            if isinstance(node.op, ast.Mult) and any(isinstance(value, (str, bytes)) for value in (left, right)):
+                count = right if isinstance(left, (str, bytes)) else left
+                sequence = left if isinstance(left, (str, bytes)) else right
+                if not isinstance(count, int) or len(sequence) * max(count, 0) > MAX_FOLDED_LENGTH:
+                    return node
+            if isinstance(node.op, ast.LShift) and isinstance(right, int) and right > 64:
+                return node
+            if isinstance(node.op, ast.Mod) and isinstance(left, (str, bytes)) and not format_small_enough(left):
+                return node
+            try:
+                return self.replace(node, operation(left, right))
+            except Exception:
+                return node
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        operation = UNARY_OPERATORS.get(type(node.op))
+        if operation and is_constant(node.operand):
+            try:
+                return self.replace(node, operation(node.operand.value))
+            except Exception:
+                return node
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if not is_constant(node.left) or not all(is_constant(comparator) for comparator in node.comparators):
+            return node
+        left = node.left.value
+        try:
+            for compare_op, comparator in zip(node.ops, node.comparators):
+                operation = COMPARE_OPERATORS.get(type(compare_op))
+                if operation is None:
+                    return node
+                if not operation(left, comparator.value):
+                    return self.replace(node, False)
+                left = comparator.value
+        except Exception:
+            return node
+        return self.replace(node, True)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        if all(is_constant(value) for value in node.values):
+            values = [value.value for value in node.values]
+            result = values[0]
+            for value in values[1:]:
+                if isinstance(node.op, ast.And):
+                    result = result and value
+                else:
+                    result = result or value
+            return self.replace(node, result)
+        return node
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, ast.Load):
+            return node
+        if isinstance(node.value, ast.Name) and node.value.id in self.constants:
+            container = self.constants[node.value.id]
+        elif is_constant(node.value):
+            container = node.value.value
+        else:
+            return node
+        if not isinstance(container, (str, bytes, tuple)):
+            return node
+
+        index = node.slice
+        try:
+            if is_constant(index):
+                return self.replace(node, container[index.value])
+            if isinstance(index, ast.Slice):
+                parts = [part.value if is_constant(part) else None for part in (index.lower, index.upper, index.step)]
+                if any(part is not None and not is_constant(part) for part in (index.lower, index.upper, index.step)):
+                    return node
+                return self.replace(node, container[slice(*parts)])
+        except Exception:
+            return node
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        function = node.func
+        if (isinstance(function, ast.Attribute) and function.attr == "join" and is_constant(function.value)
+                and isinstance(function.value.value, str) and len(node.args) == 1 and not node.keywords):
+            strings = self.joined_strings(node.args[0])
+            if strings is not None and all(isinstance(string, str) for string in strings):
+                return self.replace(node, function.value.value.join(strings))
+            return node
+
+        if node.keywords or not all(is_constant(arg) for arg in node.args):
+            return node
+        args = [arg.value for arg in node.args]
+        try:
+            if self.is_builtin(function, "chr") and len(args) == 1 and isinstance(args[0], int):
+                return self.replace(node, chr(args[0]))
+            if self.is_builtin(function, "ord") and len(args) == 1 and isinstance(args[0], str):
+                return self.replace(node, ord(args[0]))
+            if not isinstance(function, ast.Attribute):
+                return node
+
+            owner = function.value
+            if is_constant(owner):
+                owner_value = owner.value
+                if isinstance(owner_value, bytes) and function.attr == "decode" and len(args) <= 2:
+                    return self.replace(node, owner_value.decode(*args))
+                if isinstance(owner_value, str) and function.attr == "encode" and len(args) <= 2:
+                    return self.replace(node, owner_value.encode(*args))
+            elif isinstance(owner, ast.Name) and len(args) == 1:
+                if self.is_module(owner, "base64") and function.attr in ("b64decode", "b32decode", "b16decode"):
+                    return self.replace(node, getattr(base64, function.attr)(args[0]))
+                if self.is_builtin(owner, "bytes") and function.attr == "fromhex" and isinstance(args[0], str):
+                    return self.replace(node, bytes.fromhex(args[0]))
+                if self.is_module(owner, "binascii") and function.attr == "unhexlify":
+                    return self.replace(node, binascii.unhexlify(args[0]))
+        except Exception:
+            return node
+        return node
+
+    def joined_strings(self, node):
+        """
+        Finds the strings passed to str.join when they are written out as a list, tuple, or an
+        identity comprehension over a constant string.
+        :param node: the argument of a join call
+        :type node: ast.expr
+        :return: the strings, or None if they aren't all known
+        :rtype: tuple
+        """
+        if is_constant(node) and isinstance(node.value, (str, tuple)):
+            return tuple(node.value)
+        if isinstance(node, (ast.List, ast.Tuple)) and all(is_constant(element) for element in node.elts):
+            return tuple(element.value for element in node.elts)
+        if isinstance(node, (ast.ListComp, ast.GeneratorExp)) and len(node.generators) == 1:
+            generator = node.generators[0]
+            if (not generator.ifs and not generator.is_async and isinstance(generator.target, ast.Name)
+                    and isinstance(node.elt, ast.Name) and node.elt.id == generator.target.id
+                    and is_constant(generator.iter) and isinstance(generator.iter.value, (str, tuple))):
+                return tuple(generator.iter.value)
+        return None
+
+
+class BranchPruner(ast.NodeTransformer):
+    """
+    Resolves if/while statements and conditional expressions whose condition is a constant,
+    and drops statements after a return, raise, break or continue in the same block. Code holding
+    a yield, global or nonlocal is never dropped, since removing it would change how the function
+    around it behaves.
+    """
+    def __init__(self):
+        self.removed_branches = 0
+        self.removed_statements = 0
+
+    def prune_block(self, statements):
+        pruned = []
+        for position, statement in enumerate(statements):
+            result = self.visit(statement)
+            if result is None:
+                continue
+            if isinstance(result, list):
+                pruned.extend(result)
+            else:
+                pruned.append(result)
+            if pruned and isinstance(pruned[-1], TERMINATORS):
+                remaining = statements[position + 1:]
+                if affects_scope(remaining):
+                    pruned.extend(remaining)
+                else:
+                    self.removed_statements += len(remaining)
+                break
+        return pruned
+
+    def generic_visit(self, node):
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list) and value and isinstance(value[0], ast.stmt):
+                pruned = self.prune_block(value)
+                if not pruned and field in ("body", "finalbody"):
+                    pruned = [ast.Pass()]
+                setattr(node, field, pruned)
+            elif isinstance(value, list):
+                setattr(node, field, [self.visit(item) if isinstance(item, ast.AST) else item for item in value])
+            elif isinstance(value, ast.AST):
+                setattr(node, field, self.visit(value))
+        return node
+
+    def visit_If(self, node):
+        self.generic_visit(node)
+        if is_constant(node.test) and not affects_scope(node.orelse if node.test.value else node.body):
+            self.removed_branches += 1
+            return (node.body if node.test.value else node.orelse) or None
+        return node
+
+    def visit_While(self, node):
+        self.generic_visit(node)
+        if is_constant(node.test) and not node.test.value and not affects_scope(node.body):
+            self.removed_branches += 1
+            return node.orelse or None
+        return node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        if is_constant(node.test) and not affects_scope([node.orelse if node.test.value else node.body]):
+            self.removed_branches += 1
+            return node.body if node.test.value else node.orelse
+        return node
+
+
+def remove_unused_constants(tree) -> int:
+    """
+    Removes assignments of constants to local names that are never read anywhere, and expression
+    statements that are bare constants (other than docstrings). Module-level and class-level
+    assignments are always kept, since other modules may import them and they are often the
+    indicators an analyst is looking for. No assignment is removed from a file that calls exec,
+    eval, globals, locals or vars, which can read any name.
+    :param tree: parsed module, modified in place
+    :type tree: ast.Module
+    :return: number of statements removed
+    :rtype: int
+    """
+    _, loads = collect_bindings(tree)
+    dynamic_lookups = any(isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in DYNAMIC_LOOKUPS
+                          for node in ast.walk(tree))
+    removed = 0
+    # Each node is paired with whether it is in a function's own scope, where unused assignments can go.
+    pending = [(tree, False)]
+
+    while pending:
+        node, in_function = pending.pop()
+        for field in ("body", "orelse", "finalbody"):
+            statements = getattr(node, field, None)
+            if not isinstance(statements, list) or not statements or not isinstance(statements[0], ast.stmt):
+                continue
+            kept = []
+            for position, statement in enumerate(statements):
+                is_docstring = (position == 0 and field == "body"
+                                and isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)))
+                unused_assignment = (
+                    in_function and not dynamic_lookups
+                    and isinstance(statement, ast.Assign) and is_constant(statement.value)
+                    and all(isinstance(target, ast.Name) and target.id not in loads
+                            and not target.id.startswith("__") for target in statement.targets)
+                )
+                bare_constant = isinstance(statement, ast.Expr) and is_constant(statement.value) and not is_docstring
+                if unused_assignment or bare_constant:
+                    removed += 1
+                    continue
+                kept.append(statement)
+            if not kept and field in ("body", "finalbody"):
+                kept = [ast.Pass()]
+            setattr(node, field, kept)
+
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                pending.append((child, True))
+            elif isinstance(child, ast.ClassDef):
+                pending.append((child, False))
+            else:
+                pending.append((child, in_function))
+    return removed
+
+
+def normalize_code(code) -> NormalizationReport:
+    """
+    Deterministically simplifies Python source before it is sent to the LLM: folds constant
+    expressions and string-encoding tricks, resolves constant branches and removes dead code.
+    Calls that end the program (sys.exit, os._exit) are not treated as terminators, so code hidden
+    after them is kept for the analyst. Code that can't be parsed, or that can't be normalized for
+    any other reason (such as expressions nested too deeply to fold), is returned unchanged.
+    :param code: Python source code
+    :type code: str
+    :return: report holding the normalized code and what was changed
+    :rtype: NormalizationReport
+    """
+    report = NormalizationReport(original_code=code, normalized_code=code)
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return report
+
+    try:
+        for _ in range(MAX_PASSES):
+            folder = ConstantFolder(find_constant_names(tree), imported_modules(tree), collect_bindings(tree)[0])
+            tree = folder.visit(tree)
+            pruner = BranchPruner()
+            tree = pruner.visit(tree)
+            removed = remove_unused_constants(tree)
+
+            report.folded_expressions += folder.folded
+            report.removed_branches += pruner.removed_branches
+            report.removed_statements += pruner.removed_statements + removed
+            if not (folder.folded or pruner.removed_branches or pruner.removed_statements or removed):
+                break
+
+        ast.fix_missing_locations(tree)
+        normalized_code = ast.unparse(tree)
+    except Exception:
+        # Long chains like a[1] + a[2] + ... can exceed the recursion limit; the code is still sent as loaded.
+        return NormalizationReport(original_code=code, normalized_code=code)
+
+    # Unparsing alone drops comments and formatting, so the code is only replaced when something was
+    # simplified, and only when the result is actually smaller than what was loaded.
+    simplified = report.folded_expressions or report.removed_branches or report.removed_statements
+    if simplified and len(normalized_code) < len(code):
+        report.normalized_code = normalized_code
+    return report
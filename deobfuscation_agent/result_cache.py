@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+# Results are stored as one JSON file per key in this folder, relative to the working directory.
+CACHE_DIRECTORY = "./.result_cache"
+
+
+def content_hash(content) -> str:
+    """
+    Hashes file contents or generated code.
+    :param content: text or bytes to hash
+    :type content: str | bytes
+    :return: hex SHA-256 digest
+    :rtype: str
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+# Pipeline version for results computed from code that was sent to the LLM exactly as hashed.
+NO_PREPROCESSING = "none"
+
+
+def cache_key(source_hash, tool_name, prompt_version, pipeline_version) -> str:
+    """
+    Builds the key for one tool result. Changing the prompt version, or the preprocessing that
+    turns the hashed code into what the LLM sees, invalidates earlier results.
+    :param source_hash: hash of the code the tool ran on
+    :type source_hash: str
+    :param tool_name: name of the tool that produced the result
+    :type tool_name: str
+    :param prompt_version: version of the prompt used by the tool
+    :type prompt_version: str
+    :param pipeline_version: version of the preprocessing applied to the code before the prompt
+    :type pipeline_version: str
+    :return: cache key
+    :rtype: str
+    """
+    return content_hash(f"{tool_name}:{prompt_version}:{pipeline_version}:{source_hash}")
+
+
+def get_cached_result(key):
+    """
+    Looks up a stored result.
+    :param key: key from cache_key
+    :type key: str
+    :return: the stored result, or None if there is none
+    :rtype: str | None
+    """
+    try:
+        with open(os.path.join(CACHE_DIRECTORY, f"{key}.json"), "r") as file:
+            return json.load(file).get("result")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_cached_result(key, result) -> None:
+    """
+    Stores a result. The entry is written atomically, so an interrupted run never leaves a 
+    partial entry behind.
+    :param key: key from cache_key
+    :type key: str
+    :param result: tool output to store
+    :type result: str
+    """
+    write_atomically(os.path.join(CACHE_DIRECTORY, f"{key}.json"), json.dumps({"result": result}))
+
+
+def write_atomically(path, content) -> None:
+    """
+    Writes text to a temporary file next to the destination and renames it into place, so readers
+    only ever see the old contents or the complete new contents.
+    :param path: destination file path
+    :type path: str
+    :param content: text to write
+    :type content: str
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "w") as file:
+            file.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
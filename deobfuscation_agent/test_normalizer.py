@@ -0,0 +1,205 @@
+from normalizer import normalize_code
+from textwrap import dedent
+import unittest
+import ast
+
+
+def run_code(code) -> list:
+    """
+    Runs code with print captured, returning everything it printed.
+    :param code: Python source code
+    :type code: str
+    :return: printed values
+    :rtype: list
+    """
+    printed = []
+    exec(compile(code, "<normalized>", "exec"), {"print": printed.append})
+    return printed
+
+
+class NormalizeCodeTests(unittest.TestCase):
+    def assertSameBehaviour(self, code):
+        normalized_code = normalize_code(code).normalized_code
+        self.assertEqual(run_code(normalized_code), run_code(code))
+        return normalized_code
+
+    def test_folds_string_table_lookups(self):
+        code = dedent("""
+            table = "abcdefghijklmnopqrstuvwxyz"
+            if 1 == 2:
+                print("never")
+            print(table[7] + table[4] + table[11] + table[11] + table[14])
+        """)
+        normalized_code = self.assertSameBehaviour(code)
+        self.assertEqual(normalized_code.strip(), "table = 'abcdefghijklmnopqrstuvwxyz'\nprint('hello')")
+
+    def test_long_lookup_chain_falls_back_to_original(self):
+        code = "a = 'abc'\nprint(" + "+".join("a[1]" for _ in range(2000)) + ")\n"
+        self.assertEqual(normalize_code(code).normalized_code, code)
+
+    def test_huge_integers_are_not_folded(self):
+        code = "x = " + " * ".join(["99999999999999999999"] * 300) + "\nprint(x > 0)\n"
+        normalized_code = self.assertSameBehaviour(code)
+        ast.parse(normalized_code)
+
+    def test_redefined_chr_is_not_folded(self):
+        code = dedent("""
+            def chr(x):
+                return 'Z'
+            print(chr(65) + chr(66))
+        """)
+        self.assertSameBehaviour(code)
+
+    def test_rebound_bytes_is_not_folded(self):
+        code = dedent("""
+            class bytes:
+                @staticmethod
+                def fromhex(text):
+                    return 'fake ' + text
+            print(bytes.fromhex('41'))
+        """)
+        self.assertSameBehaviour(code)
+
+    def test_global_augmented_assignment_keeps_initial_value(self):
+        code = dedent("""
+            count = 0
+            def increment():
+                global count
+                count += 1
+            increment()
+            increment()
+            print('done')
+        """)
+        normalized_code = self.assertSameBehaviour(code)
+        self.assertIn("count = 0", normalized_code)
+
+    def test_nonlocal_binding_is_kept(self):
+        code = dedent("""
+            def outer():
+                n = 0
+                def inner():
+                    nonlocal n
+                    n = 5
+                inner()
+                return 'ok'
+            print(outer())
+        """)
+        normalized_code = self.assertSameBehaviour(code)
+        compile(normalized_code, "<normalized>", "exec")
+
+    def test_yield_after_return_keeps_generator(self):
+        code = dedent("""
+            def gen():
+                return
+                yield 1
+            print(type(gen()).__name__)
+        """)
+        self.assertSameBehaviour(code)
+
+    def test_yield_in_constant_false_branch_keeps_generator(self):
+        code = dedent("""
+            def gen():
+                if False:
+                    yield 1
+            print(type(gen()).__name__)
+        """)
+        self.assertSameBehaviour(code)
+
+    def test_large_format_width_is_not_evaluated(self):
+        code = "x = '%0100000000d' % 1\n"
+        normalized_code = normalize_code(code).normalized_code
+        self.assertIn("%0100000000d", normalized_code)
+        self.assertLess(len(normalized_code), 100)
+
+    def test_small_format_is_folded(self):
+        code = dedent("""
+            print('id-%03d' % 7)
+            if False:
+                print('dead code, so the folded result is shorter')
+        """)
+        normalized_code = self.assertSameBehaviour(code)
+        self.assertIn("'id-007'", normalized_code)
+
+    def test_exec_keeps_assignments_it_reads(self):
+        code = dedent("""
+            def run():
+                key = 'secret'
+                exec('print(key)')
+            run()
+            if False:
+                print('dead code')
+        """)
+        normalized_code = self.assertSameBehaviour(code)
+        self.assertIn("key = 'secret'", normalized_code)
+
+    def test_globals_lookup_keeps_module_constants(self):
+        code = dedent("""
+            C2 = 'http://evil'
+            print(globals()['C2'])
+            if False:
+                print('dead code')
+        """)
+        normalized_code = self.assertSameBehaviour(code)
+        self.assertIn("C2 = 'http://evil'", normalized_code)
+
+    def test_module_constants_are_kept(self):
+        code = dedent("""
+            NORMALIZER_VERSION = '2'
+            TIMEOUT = 30
+            if False:
+                print('dead code')
+        """)
+        normalized_code = normalize_code(code).normalized_code
+        self.assertIn("NORMALIZER_VERSION = '2'", normalized_code)
+        self.assertIn("TIMEOUT = 30", normalized_code)
+
+    def test_unused_local_constant_is_removed(self):
+        code = dedent("""
+            def run():
+                unused = 'padding padding padding'
+                print('ran')
+            run()
+        """)
+        normalized_code = self.assertSameBehaviour(code)
+        self.assertNotIn("unused", normalized_code)
+
+    def test_code_with_nothing_to_simplify_keeps_comments(self):
+        code = dedent("""
+            # Adds two numbers.
+            def add(a, b):
+                return a + b    # the sum
+        """)
+        report = normalize_code(code)
+        self.assertEqual(report.normalized_code, code)
+        self.assertFalse(report.changed)
+
+    def test_global_in_constant_false_branch_is_kept(self):
+        code = dedent("""
+            x = 1
+            def f():
+                if False:
+                    global x
+                x = 2
+            f()
+            print(x)
+        """)
+        self.assertSameBehaviour(code)
+
+    def test_match_capture_is_not_folded(self):
+        code = dedent("""
+            t = 'abc'
+            match 'xyz':
+                case t:
+                    print(t[0])
+            if False:
+                print('dead code')
+        """)
+        self.assertSameBehaviour(code)
+
+    def test_unparseable_code_is_returned_unchanged(self):
+        code = "def broken(:\n"
+        self.assertEqual(normalize_code(code).normalized_code, code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,30 +1,76 @@
 from langchain_google_genai import GoogleGenerativeAI, HarmCategory, HarmBlockThreshold
 from langchain_openai import ChatOpenAI
-from langchain.agents import AgentExecutor, create_react_agent
+from langchain.agents import AgentExecutor, create_react_agent, create_tool_calling_agent
 from langchain_community.agent_toolkits.load_tools import load_tools
-from langsmith import Client
 from langchain_core.pydantic_v1 import BaseModel, Field, validator
-from langchain_core.prompts import PromptTemplate
-from langchain_core.tools import tool
+from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.tools import tool, Tool, StructuredTool
+from langchain_core.callbacks import BaseCallbackHandler
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import dedent
 from subprocess import run
+import functools
 import requests
 import socket
 import shlex
 import validators
 import dns.resolver as resolver
 import traceback
+import argparse
+import json
+import asyncio
 import os
+import sys
 
+# Modules shared between the apps live in the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tracing import configure_tracing
+from common.instrumentation import install_instrumentation, print_metrics, token_usage
 
 
 
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
-os.environ["LANGCHAIN_PROJECT"] = f"gensec-hw6"
-os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
-client = Client()
 
-gpt_llm = ChatOpenAI(model='gpt-4o', temperature=0)
+# Traces go to LangSmith unless TRACING_MODE=local (sampled, compressed file) or TRACING_MODE=off is set.
+configure_tracing("gensec-hw6")
+# Latency, time-to-first-token and token counts of every run, shown by the "stats" command.
+metrics = install_instrumentation()
+
+# stream_usage makes streamed calls, which the agent executor uses by default, report their token counts too.
+gpt_llm = ChatOpenAI(model='gpt-4o', temperature=0, stream_usage=True)
+
+
+# Seconds a single tool call may run in parallel mode before its observation is replaced with a timeout notice.
+DEFAULT_TOOL_TIMEOUT = 10
+
+# Seconds each HTTP request or DNS query inside a tool may take, so an abandoned call still frees its thread.
+LOOKUP_TIMEOUT = 10
+
+# Threads running tool functions in parallel mode. Tools get their own pool, so lookups that can't be interrupted
+# (reverse DNS through the system resolver) can never use up the event loop's default executor.
+TOOL_WORKERS = 16
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="ip-tools")
+
+AGENT_INSTRUCTIONS = dedent("""You are an agent that is used for helping the user get IP and DNS information.
+    Be as helpful as possible. If you are unable to produce an answer that is helpful to the user, say so.
+    The user is allowed to look up information with SERPAPI related to IP and DNS queries ONLY. Deny them in any other case.
+    Because your tools provide a lot of dense information, structure your final friendly response by separating each tool 
+    call's answer in a visually pleasing list, with proper whitespace.
+    If one of your tools requires a DNS name or IP address but the user provides the wrong type, use the retrieve_ip and retrieve_dns_host tools to get the right input.""")
+
+# Limits applied to tool observations before they enter the agent scratchpad. Adjustable from the command line.
+OUTPUT_LIMITS = {
+    "records_per_type": 5,
+    "observation_chars": 800,
+}
+
+# DNS answers are kept for their TTL in one cache shared by every lookup in the process, including concurrent requests
+# served by the HTTP service.
+DNS_CACHE_SIZE = 1000
+dns_cache = resolver.LRUCache(DNS_CACHE_SIZE)
+
+PARALLEL_INSTRUCTIONS = dedent("""
+    When several lookups do not depend on each other (for example location, DNS records, reverse DNS and ping for the same address),
+    request all of those tool calls at once in a single step instead of one after another.""")
 
 
 
@@ -58,30 +104,104 @@ class HostNameInput(BaseModel):
         return value
 
 
+class PromptTokenCounter(BaseCallbackHandler):
+    """
+    Records the token usage reported for each LLM call, so the growth of the agent scratchpad
+    can be measured per iteration.
+    """
+    def __init__(self):
+        self.iterations = []
+
+    def on_llm_end(self, response, **kwargs):
+        self.iterations.append(token_usage(response))
+
+    def report(self) -> str:
+        """
+        Formats the token usage of every recorded iteration with a total.
+        :return: per-iteration token report
+        :rtype: str
+        """
+        lines = [f"Iteration {index}: {prompt} prompt tokens, {completion} completion tokens" 
+                 for index, (prompt, completion) in enumerate(self.iterations, start=1)]
+        total_prompt = sum(prompt for prompt, _ in self.iterations)
+        total_completion = sum(completion for _, completion in self.iterations)
+        lines.append(f"Total: {total_prompt} prompt tokens, {total_completion} completion tokens")
+        return "\n".join(lines)
+
+
+def compact_output(data) -> str:
+    """
+    Serializes tool output as compact JSON, truncated to the configured observation length.
+    :param data: structured tool result
+    :type data: dict
+    :return: compact JSON string
+    :rtype: str
+    """
+    output = json.dumps(data, separators=(",", ":"))
+    max_chars = OUTPUT_LIMITS["observation_chars"]
+    if len(output) > max_chars:
+        output = output[:max_chars] + "...(truncated)"
+    return output
+
+
+def truncate_records(records) -> list:
+    """
+    Keeps the first records of one type up to the configured limit, noting how many were dropped.
+    :param records: normalized record strings
+    :type records: list
+    :return: truncated list of records
+    :rtype: list
+    """
+    limit = OUTPUT_LIMITS["records_per_type"]
+    if len(records) > limit:
+        return records[:limit] + [f"+{len(records) - limit} more"]
+    return records
+
+
+def dns_resolver():
+    """
+    Returns the default DNS resolver with the shared answer cache attached.
+    :return: dnspython resolver
+    :rtype: dns.resolver.Resolver
+    """
+    default_resolver = resolver.get_default_resolver()
+    default_resolver.cache = dns_cache
+    return default_resolver
+
+
 @tool("retrieve_DNS_host", args_schema=IPv4Input, return_direct=False)
-def retrieve_DNS_host(ip_address):
+def retrieve_DNS_host(address):
     """
     Given an IPv4 address, returns DNS hostname associated with it.
     """
     try:
-        hostname, _, _ = socket.gethostbyaddr(ip_address)
+        hostname, _, _ = socket.gethostbyaddr(address)
         return hostname
     except socket.herror:
         raise ValueError("The IP address is not valid. Please enter an IPv4 address with no CIDR notation.")
 
 
 @tool("ip_location_info", args_schema=IPv4Input, return_direct=False)
-def ip_location_info(ip_address):
+def ip_location_info(address):
     """
     Get relevant location and organization information for an IP address.
     """
-    response = requests.get(f'https://ipapi.co/{ip_address}/json/').json()
-    location_info = {
-        'location': f"{response.get('city','N/A')}, {response.get('region','N/A')} - {response.get('country_name','N/A')} ({response.get('continent_code','N/A')})",
-        'coordinates': f"Latitude: {response.get('latitude', 'N/A')} - Longitude: {response.get('longitude', 'N/A')}",
-        'organization': response.get('org', 'N/A')
+    response = requests.get(f'https://ipapi.co/{address}/json/', timeout=LOOKUP_TIMEOUT).json()
+    # Errors such as rate limiting or reserved addresses are passed on, so the model can report them.
+    if response.get('error'):
+        return compact_output({key: response[key] for key in ('error', 'reason', 'message') if key in response})
+    fields = {
+        'city': 'city',
+        'region': 'region',
+        'country': 'country_name',
+        'continent': 'continent_code',
+        'lat': 'latitude',
+        'lon': 'longitude',
+        'org': 'org',
     }
-    return location_info
+    # Missing fields are left out rather than sent to the model as N/A.
+    location_info = {key: response[field] for key, field in fields.items() if response.get(field) not in (None, "")}
+    return compact_output(location_info)
 
 
 @tool("retrieve_ip", args_schema=HostNameInput, return_direct=False)
@@ -100,37 +220,83 @@ def retrieve_ip(hostname):
 def retrieve_DNS_records(hostname):
     """
     Needs a DNS hostname. Will retrieve relevant DNS records with a dig (A, AAAA, NS, MX).
+    Returns a JSON object of record type to record values; an empty list means no record of that type.
     """
     record_types = ['A', 'AAAA', 'NS', 'MX']
-    final_records = ""
+    final_records = {}
     for record_type in record_types:
         try:
-            resolved_info = resolver.resolve(hostname, record_type).response
-            records = resolved_info.resolve_chaining().answer
-            final_records += f"\n{str(records)}\n"
+            answer = dns_resolver().resolve(hostname, record_type, lifetime=LOOKUP_TIMEOUT)
+            records = sorted(rdata.to_text().rstrip('.') for rdata in answer)
         except resolver.NoAnswer:
-            final_records += f"No {record_type} record for this hostname.\n\n"
+            records = []
+        final_records[record_type] = truncate_records(records)
 
-    return final_records
+    return compact_output(final_records)
 
 
 @tool("ping_host", args_schema=IPv4Input, return_direct=False)
-def ping_host(ip_address):
+def ping_host(address):
     """
     Given an IPv4 address, will ping it and return the ping output. 
     """
     command = "ping"
     flag = "/n" if os.name == 'nt' else "-c"
-    address = shlex.split(ip_address)[0]
-    completed_process = run([command, flag, "2", address], capture_output=True, timeout=2)
+    ping_address = shlex.split(address)[0]
+    completed_process = run([command, flag, "2", ping_address], capture_output=True, timeout=2)
     output = completed_process.stdout.decode('utf-8')
 
-    return output
-
-
+    # Only the summary lines (packet loss and round-trip times) are kept, when they can be found.
+    summary = [line.strip() for line in output.splitlines() 
+               if any(marker in line for marker in ("packet", "Packets", "rtt", "round-trip", "Minimum"))]
+    return compact_output({"summary": summary} if summary else {"output": output.strip()})
 
 
-def main():
+def with_timeout(base_tool, timeout):
+    """
+    Copies a tool, giving it a coroutine that runs the tool's function on the tool thread pool with a time limit.
+    Timeouts, malformed arguments, invalid input and any other error are returned as the observation, so one slow or failed lookup doesn't
+    cancel the other tool calls running alongside it.
+    :param base_tool: LangChain tool with a synchronous function
+    :type base_tool: BaseTool
+    :param timeout: maximum seconds the tool may run
+    :type timeout: float
+    :return: copy of the tool that can be awaited concurrently
+    :rtype: BaseTool
+    """
+    async def run_with_timeout(*args, **kwargs):
+        try:
+            loop = asyncio.get_running_loop()
+            call = functools.partial(base_tool.func, *args, **kwargs)
+            return await asyncio.wait_for(loop.run_in_executor(tool_executor, call), timeout=timeout)
+        except asyncio.TimeoutError:
+            return f"{base_tool.name} did not finish within {timeout} seconds."
+        except ValueError as v_error:
+            return str(v_error)
+        except Exception as error:
+            # Lookup failures (NXDOMAIN, HTTP errors, ping's own timeout) become the observation too.
+            return f"{base_tool.name} failed: {type(error).__name__}: {error}"
+
+    if isinstance(base_tool, StructuredTool):
+        return StructuredTool.from_function(
+                func=base_tool.func, 
+                coroutine=run_with_timeout, 
+                name=base_tool.name, 
+                description=base_tool.description, 
+                args_schema=base_tool.args_schema,
+                handle_validation_error=True
+        )
+    return Tool(name=base_tool.name, func=base_tool.func, coroutine=run_with_timeout, description=base_tool.description)
+
+
+def create_react_executor(tools):
+    """
+    Creates the ReAct agent executor, which takes a single action per thought.
+    :param tools: List of LangChain tools
+    :type tools: list
+    :return: Completed agent executor
+    :rtype: AgentExecutor
+    """
     base_prompt = PromptTemplate.from_template(dedent("""
         {instructions}
 
@@ -158,19 +324,10 @@ def main():
 
         {agent_scratchpad} 
     """))
-
-    prompt = base_prompt.partial(instructions=dedent("""You are an agent that is used for helping the user get IP and DNS information.
-        Be as helpful as possible. If you are unable to produce an answer that is helpful to the user, say so.
-        The user is allowed to look up information with SERPAPI related to IP and DNS queries ONLY. Deny them in any other case.
-        Because your tools provide a lot of dense information, structure your final friendly response by separating each tool 
-        call's answer in a visually pleasing list, with proper whitespace.
-        If one of your tools requires a DNS name or IP address but the user provides the wrong type, use the retrieve_ip and retrieve_dns_host tools to get the right input."""))
-
-    tools = load_tools(["serpapi"])
-    tools.extend([retrieve_DNS_host, ip_location_info, retrieve_ip, retrieve_DNS_records, ping_host])
+    prompt = base_prompt.partial(instructions=AGENT_INSTRUCTIONS)
 
     gpt_agent = create_react_agent(gpt_llm, tools, prompt)
-    gpt_executor = AgentExecutor(
+    return AgentExecutor(
             agent=gpt_agent, 
             tools=tools, 
             max_iterations=5, 
@@ -178,26 +335,106 @@ def main():
     )
 
 
+def create_parallel_executor(tools, tool_timeout, llm=gpt_llm, verbose=True):
+    """
+    Creates a tool-calling agent executor. The model may request several tool calls in one step; 
+    the executor awaits them concurrently and returns every observation to the model together.
+    :param tools: List of LangChain tools
+    :type tools: list
+    :param tool_timeout: maximum seconds for each tool call
+    :type tool_timeout: float
+    :param llm: chat model that supports tool calling
+    :type llm: LangChain chat model object
+    :param verbose: print each step of the agent
+    :type verbose: bool
+    :return: Completed agent executor, which must be run with ainvoke
+    :rtype: AgentExecutor
+    """
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", AGENT_INSTRUCTIONS + PARALLEL_INSTRUCTIONS),
+        ("human", "{input}"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ])
+
+    timed_tools = [with_timeout(base_tool, tool_timeout) for base_tool in tools]
+    gpt_agent = create_tool_calling_agent(llm, timed_tools, prompt)
+    return AgentExecutor(
+            agent=gpt_agent, 
+            tools=timed_tools, 
+            max_iterations=5, 
+            verbose=verbose
+    )
+
+
+def load_agent_tools() -> list:
+    """
+    Gathers the web search tool and the IP and DNS lookup tools given to the agent.
+    :return: List of LangChain tools
+    :rtype: list
+    """
+    tools = load_tools(["serpapi"])
+    tools.extend([retrieve_DNS_host, ip_location_info, retrieve_ip, retrieve_DNS_records, ping_host])
+    return tools
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IP and DNS information agent.")
+    parser.add_argument("--parallel", action="store_true", 
+                        help="let the agent run several independent tool calls concurrently in one step")
+    parser.add_argument("--tool-timeout", type=float, default=DEFAULT_TOOL_TIMEOUT, 
+                        help="seconds each tool call may take in parallel mode")
+    parser.add_argument("--max-records", type=int, default=OUTPUT_LIMITS["records_per_type"], 
+                        help="maximum DNS records of each type returned to the agent")
+    parser.add_argument("--max-observation-chars", type=int, default=OUTPUT_LIMITS["observation_chars"], 
+                        help="maximum characters of each tool observation returned to the agent")
+    parser.add_argument("--token-report", action="store_true", 
+                        help="print prompt and completion tokens for each agent iteration")
+    args = parser.parse_args()
+    OUTPUT_LIMITS["records_per_type"] = args.max_records
+    OUTPUT_LIMITS["observation_chars"] = args.max_observation_chars
+
+    tools = load_agent_tools()
+
+    if args.parallel:
+        gpt_executor = create_parallel_executor(tools, args.tool_timeout)
+    else:
+        gpt_executor = create_react_executor(tools)
+
+
 
     print("\n\nThis agent is equipped with multiple tools that help you find information on IP addresses and DNS names.\n\n")
     for tool in gpt_executor.tools:
         print(f"\n{tool.name}: \n\n\t{tool.description}")
     
 
-    while True:
-        try:
-            line = input("\n\nEnter query (\"exit\" to end) >>  ")
-            if line and line != "exit": 
-                print("\n\n\nPlease wait while the Agent completes your request.\n\n\n")
-                result = gpt_executor.invoke({"input":line})
-                print(f"\n\n{result.get('output')}")
-            else:
-                break
-
-        except ValueError as v_error:
-            print(f"\n\n{str(v_error)}")
-        except Exception:
-            traceback.print_exc()
+    # One event loop serves every query, so the async HTTP clients' pooled connections stay usable between queries.
+    with asyncio.Runner() as runner:
+        while True:
+            try:
+                line = input("\n\nEnter query (\"stats\" for latency, \"exit\" to end) >>  ")
+                if line == "stats":
+                    print_metrics(metrics)
+                    continue
+                if line and line != "exit": 
+                    print("\n\n\nPlease wait while the Agent completes your request.\n\n\n")
+                    token_counter = PromptTokenCounter()
+                    config = {"callbacks": [token_counter]}
+                    if args.parallel:
+                        result = runner.run(gpt_executor.ainvoke({"input":line}, config=config))
+                    else:
+                        result = gpt_executor.invoke({"input":line}, config=config)
+                    print(f"\n\n{result.get('output')}")
+                    if args.token_report:
+                        print(f"\n\n{token_counter.report()}")
+                else:
+                    break
+
+            except ValueError as v_error:
+                print(f"\n\n{str(v_error)}")
+            except Exception:
+                traceback.print_exc()
 
     return
 
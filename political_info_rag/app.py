@@ -9,14 +9,31 @@ from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain_openai import ChatOpenAI
 import traceback
-from langsmith import Client
 import os
+import sys
 
+# Modules shared between the apps live in the repository root.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.tracing import configure_tracing
+from common.instrumentation import install_instrumentation, print_metrics
 
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
-os.environ["LANGCHAIN_PROJECT"] = f"gensec-hw1"
-os.environ["LANGCHAIN_ENDPOINT"] = "https://api.smith.langchain.com"
-client = Client()
+
+# Traces go to LangSmith unless TRACING_MODE=local (sampled, compressed file) or TRACING_MODE=off is set.
+configure_tracing("gensec-hw1")
+# Latency, time-to-first-token and token counts of every run, shown by the "stats" command.
+metrics = install_instrumentation()
+
+# Sources and the vector store are found relative to this file, so the chains can also be built from other folders.
+APP_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+CONTEXT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a bot that helps answer questions about political figures. Find the relevant 
+    information about the political figure the user gives, then answer their question. In searching 
+    for accurate information, use only the provided context. Limit your answer to ten sentences. If 
+    you do not know how to answer a question, just say that you don't know.
+    Provided context: {context}"""),
+    ("human", "{query}"),
+])
 
 
 def embed_docs(documents, vector_db) -> None:
@@ -36,8 +53,8 @@ def load_and_transform(vector_db) -> None:
     them, then embeds and adds to vector store.
     :param vector_db: Chroma object
     """
-    urls = retrieve_file("./sources/urls/urls.txt")
-    wiki_topics = retrieve_file("./sources/wiki/wiki-pages.txt")
+    urls = retrieve_file(os.path.join(APP_DIRECTORY, "sources/urls/urls.txt"))
+    wiki_topics = retrieve_file(os.path.join(APP_DIRECTORY, "sources/wiki/wiki-pages.txt"))
     loaded_web_docs = AsyncHtmlLoader(urls).load()
     transformer = BeautifulSoupTransformer()
     transformed_docs = transformer.transform_documents(loaded_web_docs, tags_to_extract=["p"])
@@ -91,12 +108,25 @@ def db_exists(vector_db) -> bool:
 
 
 
-def main():
+def create_vector_db():
+    """
+    Opens the persisted Chroma store, loading and embedding the sources first if it is empty.
+    :return: Chroma object
+    """
     vector_db = Chroma(
         embedding_function=GoogleGenerativeAIEmbeddings(model="models/embedding-001", task_type="retrieval_query"),
-        persist_directory="./chroma/.chromadb"
+        persist_directory=os.path.join(APP_DIRECTORY, "chroma/.chromadb")
     )
+    if not db_exists(vector_db):
+        load_and_transform(vector_db)
+    return vector_db
 
+
+def create_llms() -> tuple:
+    """
+    Creates the Gemini and GPT models that answer questions.
+    :return: tuple of Gemini and GPT LLM objects
+    """
     gemini_llm = GoogleGenerativeAI(
             model="gemini-pro",
             temperature=0,
@@ -108,48 +138,50 @@ def main():
             }
     )
 
-    gpt_llm = ChatOpenAI(model_name="gpt-3.5-turbo")
+    gpt_llm = ChatOpenAI(model_name="gpt-3.5-turbo", stream_usage=True)
+    return gemini_llm, gpt_llm
 
-    if not db_exists(vector_db):
-        load_and_transform(vector_db)
 
+def create_query_chain(retriever, llm):
+    """
+    Builds the chain answering a question from the retrieved context. It keeps no per-question
+    state, so one chain per model can be shared by concurrent questions.
+    :param retriever: VectorStoreRetriever object
+    :param llm: LLM object answering the question
+    :return: RunnableSequence taking the question as a string
+    """
+    return (
+            {"context": retriever | combine_docs, "query": RunnablePassthrough()}
+            | CONTEXT_PROMPT
+            | llm
+            | StrOutputParser()
+    )
+
+
+
+
+def main():
+    vector_db = create_vector_db()
+    gemini_llm, gpt_llm = create_llms()
 
     retriever = vector_db.as_retriever()
     print_sources(retriever)
 
-
-    context_prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are a bot that helps answer questions about political figures. Find the relevant 
-        information about the political figure the user gives, then answer their question. In searching 
-        for accurate information, use only the provided context. Limit your answer to ten sentences. If 
-        you do not know how to answer a question, just say that you don't know.
-        Provided context: {context}"""),
-        ("human", "{query}"),
-    ])
-       
     # Set up a chain for each model, using the same context.
-    gemini_query_chain = (
-            {"context": retriever | combine_docs, "query": RunnablePassthrough()}
-            | context_prompt
-            | gemini_llm
-            | StrOutputParser()
-    )
-
-    gpt_query_chain = (
-            {"context": retriever | combine_docs, "query": RunnablePassthrough()}
-            | context_prompt
-            | gpt_llm
-            | StrOutputParser()
-    )
+    gemini_query_chain = create_query_chain(retriever, gemini_llm)
+    gpt_query_chain = create_query_chain(retriever, gpt_llm)
 
     
     
     print("""\n\nWelcome to the 2024 Presidential candidates RAG app. Ask some questions about the two current nominees!
-            \nEnter \"exit\" to quit the program.""")
+            \nEnter \"stats\" to see latency and token metrics, or \"exit\" to quit the program.""")
     while True:
         try:
             # Invoke a call for each model to answer the same query. 
             line = input("\n\nEnter query >> ")
+            if line == "stats":
+                print_metrics(metrics)
+                continue
             if line and line != "exit": 
                 print("\n\nGemini's answer: \n")
                 for chunk in gemini_query_chain.stream(line):
@@ -0,0 +1,394 @@
+from aiohttp import web
+from contextlib import asynccontextmanager
+import importlib.util
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules shared between the apps live in the repository root.
+sys.path.append(REPOSITORY_ROOT)
+from common.tracing import configure_tracing
+from common.instrumentation import install_instrumentation
+
+
+metrics = install_instrumentation()
+
+# Requests allowed to use each provider at the same time. A request holds its slots until its response is finished.
+DEFAULT_PROVIDER_LIMITS = {"google": 8, "openai": 8}
+# Requests allowed to wait for provider slots. Any more are turned away with 503 instead of queuing without limit.
+DEFAULT_MAX_WAITING = 64
+# Seconds a request may wait for its provider slots before it is turned away.
+DEFAULT_QUEUE_TIMEOUT = 30.0
+# Seconds each IP agent tool call may take.
+DEFAULT_TOOL_TIMEOUT = 10
+# Events held for one response while the client reads slowly. When full, the chains wait for the client.
+STREAM_BUFFER = 32
+
+
+
+
+class QueueFull(Exception):
+    """
+    Raised when a request can't get provider slots, because too many requests are already waiting
+    or because it waited longer than the queue timeout.
+    """
+
+
+class ProviderLimiter:
+    """
+    Caps how many requests use each LLM provider at once. Requests beyond the cap wait in line, and
+    requests beyond the waiting limit are rejected straight away.
+    :param limits: map of provider name to concurrent requests allowed
+    :type limits: dict
+    :param max_waiting: requests allowed to wait for slots
+    :type max_waiting: int
+    :param queue_timeout: seconds a request may wait for slots
+    :type queue_timeout: float
+    """
+    def __init__(self, limits, max_waiting=DEFAULT_MAX_WAITING, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.limits = dict(limits)
+        self.semaphores = {provider: asyncio.Semaphore(limit) for provider, limit in self.limits.items()}
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.active = {provider: 0 for provider in self.limits}
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def reserve(self, providers):
+        """
+        Waits for one slot with each provider and holds them until the block exits. Slots are always
+        taken in the same order, so two requests can never each hold a slot the other is waiting for.
+        :param providers: names of the providers the request will call
+        :type providers: Iterable[str]
+        :raises QueueFull: when the request can't be queued or waits too long
+        """
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise QueueFull(f"{self.waiting} requests are already waiting. Try again shortly.")
+
+        acquired = []
+        self.waiting += 1
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                for provider in sorted(set(providers)):
+                    await self.semaphores[provider].acquire()
+                    acquired.append(provider)
+        except TimeoutError:
+            self.release(acquired)
+            self.rejected += 1
+            raise QueueFull(f"No capacity became free within {self.queue_timeout} seconds. Try again shortly.")
+        except BaseException:
+            self.release(acquired)
+            raise
+        finally:
+            self.waiting -= 1
+
+        for provider in acquired:
+            self.active[provider] += 1
+        try:
+            yield
+        finally:
+            for provider in acquired:
+                self.active[provider] -= 1
+            self.release(acquired)
+
+    def release(self, providers) -> None:
+        for provider in providers:
+            self.semaphores[provider].release()
+
+    def status(self) -> dict:
+        return dict(limits=self.limits, active=self.active, waiting=self.waiting, rejected=self.rejected)
+
+
+class Services:
+    """
+    Chains, agents and clients built once at startup and shared by every request. Each chain or
+    agent is paired with the name of the provider it calls.
+    :param vulnerability_chains: map of model label to (provider, vulnerability identifier chain)
+    :type vulnerability_chains: dict
+    :param rag_chains: map of model label to (provider, RAG question answering chain)
+    :type rag_chains: dict
+    :param ip_agent: (provider, IP agent executor)
+    :type ip_agent: tuple
+    :param token_counter: function returning the number of tokens in a string
+    :type token_counter: Callable[[str], int]
+    :param max_prompt_tokens: largest code submission accepted, in tokens
+    :type max_prompt_tokens: int
+    """
+    def __init__(self, vulnerability_chains, rag_chains, ip_agent, token_counter, max_prompt_tokens):
+        self.vulnerability_chains = vulnerability_chains
+        self.rag_chains = rag_chains
+        self.ip_agent = ip_agent
+        self.token_counter = token_counter
+        self.max_prompt_tokens = max_prompt_tokens
+
+
+def load_app(folder):
+    """
+    Imports an app's app.py under a name of its own, so the apps' modules don't replace each other.
+    Clients an app creates at import are created once here and shared.
+    :param folder: folder name of the app
+    :type folder: str
+    :return: the imported module
+    :rtype: module
+    """
+    spec = importlib.util.spec_from_file_location(f"{folder}_app", os.path.join(REPOSITORY_ROOT, folder, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_services(tool_timeout=DEFAULT_TOOL_TIMEOUT) -> Services:
+    """
+    Builds the vulnerability identifier, the RAG Q&A and the IP agent with real clients. The RAG
+    vector store is opened, and filled if empty, once for all requests.
+    :param tool_timeout: maximum seconds for each IP agent tool call
+    :type tool_timeout: float
+    :return: shared services
+    :rtype: Services
+    """
+    async_chains = load_app("async_chains")
+    political_info_rag = load_app("political_info_rag")
+    ip_info_agent = load_app("ip_info_agent")
+    # Each app names its own tracing project on import; requests to the service are traced together.
+    configure_tracing("gensec-service")
+
+    retriever = political_info_rag.create_vector_db().as_retriever()
+    rag_gemini_llm, rag_gpt_llm = political_info_rag.create_llms()
+    ip_executor = ip_info_agent.create_parallel_executor(ip_info_agent.load_agent_tools(), tool_timeout, verbose=False)
+
+    return Services(
+        vulnerability_chains={
+            "gemini": ("google", async_chains.create_vulnerability_chain(async_chains.gemini_llm)),
+            "gpt": ("openai", async_chains.create_vulnerability_chain(async_chains.gpt_llm)),
+        },
+        rag_chains={
+            "gemini": ("google", political_info_rag.create_query_chain(retriever, rag_gemini_llm)),
+            "gpt": ("openai", political_info_rag.create_query_chain(retriever, rag_gpt_llm)),
+        },
+        ip_agent=("openai", ip_executor),
+        token_counter=async_chains.gemini_llm.get_num_tokens,
+        max_prompt_tokens=async_chains.MAX_PROMPT_TOKENS,
+    )
+
+
+async def chain_events(chain, chain_input):
+    """
+    Streams a chain's output as token events.
+    :param chain: chain producing a string
+    :type chain: LangChain Runnable
+    :param chain_input: input for the chain
+    :return: async iterator of events
+    """
+    async for chunk in chain.astream(chain_input):
+        yield dict(type="token", text=chunk)
+
+
+async def agent_events(executor, agent_input):
+    """
+    Streams an agent's tool calls, their results and its final answer as events.
+    :param executor: agent executor to run
+    :type executor: AgentExecutor
+    :param agent_input: inputs for the executor
+    :type agent_input: dict
+    :return: async iterator of events
+    """
+    async for chunk in executor.astream(agent_input):
+        for action in chunk.get("actions", []):
+            yield dict(type="action", tool=action.tool, input=action.tool_input)
+        for step in chunk.get("steps", []):
+            yield dict(type="observation", tool=step.action.tool, text=str(step.observation))
+        if "output" in chunk:
+            yield dict(type="answer", text=chunk["output"])
+
+
+async def stream_events(request, sources) -> web.StreamResponse:
+    """
+    Runs every source concurrently and writes their events to the response as JSON lines, in the
+    order they are produced. Each line names its source; a source ends with a "done" or "error" event.
+    :param request: the HTTP request
+    :type request: aiohttp.web.Request
+    :param sources: map of source label to an async iterator of events
+    :type sources: dict
+    :return: the finished response
+    :rtype: aiohttp.web.StreamResponse
+    """
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+
+    async def forward(label, events):
+        try:
+            async for event in events:
+                await queue.put(dict(source=label, **event))
+            await queue.put(dict(source=label, type="done"))
+        except Exception as error:
+            await queue.put(dict(source=label, type="error", error=str(error)))
+
+    tasks = [asyncio.create_task(forward(label, events)) for label, events in sources.items()]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            event = await queue.get()
+            if event["type"] in ("done", "error"):
+                remaining -= 1
+            # Waits while the client's connection is backed up, which in turn pauses the sources.
+            await response.write((json.dumps(event, default=str) + "\n").encode())
+    finally:
+        # Stops the sources if the client went away before they finished.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    await response.write_eof()
+    return response
+
+
+async def stream_with_limits(request, sources, check=None) -> web.StreamResponse:
+    """
+    Waits for the providers' slots, then streams the sources. A request that can't be queued is
+    answered with 503 before any of the response is sent.
+    :param request: the HTTP request
+    :type request: aiohttp.web.Request
+    :param sources: map of source label to (provider, async iterator of events)
+    :type sources: dict
+    :param check: coroutine function run while the slots are held, before streaming starts; it may
+                  raise an HTTP error to reject the request
+    :type check: Callable[[], Awaitable[None]]
+    :return: the finished response
+    :rtype: aiohttp.web.StreamResponse
+    """
+    limiter = request.app["limiter"]
+    try:
+        async with limiter.reserve(provider for provider, _ in sources.values()):
+            if check is not None:
+                await check()
+            return await stream_events(request, {label: events for label, (_, events) in sources.items()})
+    except QueueFull as error:
+        raise web.HTTPServiceUnavailable(text=str(error), headers={"Retry-After": "1"})
+
+
+async def read_field(request, field) -> str:
+    """
+    Reads a required string field from a JSON request body.
+    :param request: the HTTP request
+    :type request: aiohttp.web.Request
+    :param field: name of the field
+    :type field: str
+    :return: the field's value
+    :rtype: str
+    """
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="The request body must be JSON.")
+    value = body.get(field) if isinstance(body, dict) else None
+    if not isinstance(value, str) or not value.strip():
+        raise web.HTTPBadRequest(text=f"The request body needs a non-empty \"{field}\" string.")
+    return value
+
+
+async def vulnerabilities(request) -> web.StreamResponse:
+    """
+    POST /vulnerabilities {"code": "..."}: streams each model's verified list of the top
+    vulnerabilities in a piece of C or C++ code.
+    """
+    services = request.app["services"]
+    code = await read_field(request, "code")
+
+    async def check_size():
+        # Counting tokens is a Gemini request too, so it only runs once the request holds its provider slots.
+        token_count = await asyncio.to_thread(services.token_counter, code)
+        if token_count > services.max_prompt_tokens:
+            raise web.HTTPBadRequest(text=f"The code you are trying to enter ({token_count} tokens) is too large for the {services.max_prompt_tokens} token limit.")
+
+    return await stream_with_limits(request, {
+        label: (provider, chain_events(chain, {"code_content": code}))
+        for label, (provider, chain) in services.vulnerability_chains.items()
+    }, check=check_size)
+
+
+async def ask(request) -> web.StreamResponse:
+    """
+    POST /ask {"query": "..."}: streams each model's answer to a question about the candidates,
+    using the shared vector store for context.
+    """
+    services = request.app["services"]
+    query = await read_field(request, "query")
+    return await stream_with_limits(request, {
+        label: (provider, chain_events(chain, query))
+        for label, (provider, chain) in services.rag_chains.items()
+    })
+
+
+async def ip_info(request) -> web.StreamResponse:
+    """
+    POST /ip {"query": "..."}: streams the IP agent's tool calls, observations and final answer.
+    """
+    provider, executor = request.app["services"].ip_agent
+    query = await read_field(request, "query")
+    return await stream_with_limits(request, {"agent": (provider, agent_events(executor, {"input": query}))})
+
+
+async def metrics_report(request) -> web.Response:
+    """
+    GET /metrics: latency percentiles of recent runs and the current provider queue.
+    """
+    return web.json_response(dict(queue=request.app["limiter"].status(), runs=metrics.summary()))
+
+
+def create_app(services, provider_limits=DEFAULT_PROVIDER_LIMITS, max_waiting=DEFAULT_MAX_WAITING, queue_timeout=DEFAULT_QUEUE_TIMEOUT) -> web.Application:
+    """
+    Creates the HTTP application around a set of shared services.
+    :param services: chains and agents shared by every request
+    :type services: Services
+    :param provider_limits: map of provider name to concurrent requests allowed
+    :type provider_limits: dict
+    :param max_waiting: requests allowed to wait for provider slots
+    :type max_waiting: int
+    :param queue_timeout: seconds a request may wait for provider slots
+    :type queue_timeout: float
+    :return: the application, ready to run
+    :rtype: aiohttp.web.Application
+    """
+    app = web.Application()
+    app["services"] = services
+    app["limiter"] = ProviderLimiter(provider_limits, max_waiting, queue_timeout)
+    app.router.add_post("/vulnerabilities", vulnerabilities)
+    app.router.add_post("/ask", ask)
+    app.router.add_post("/ip", ip_info)
+    app.router.add_get("/metrics", metrics_report)
+    return app
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the vulnerability identifier, the RAG Q&A and the IP agent over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--google-limit", type=int, default=DEFAULT_PROVIDER_LIMITS["google"],
+                        help="requests allowed to use Gemini at the same time")
+    parser.add_argument("--openai-limit", type=int, default=DEFAULT_PROVIDER_LIMITS["openai"],
+                        help="requests allowed to use OpenAI at the same time")
+    parser.add_argument("--max-waiting", type=int, default=DEFAULT_MAX_WAITING,
+                        help="requests allowed to wait for a provider before new ones are rejected")
+    parser.add_argument("--queue-timeout", type=float, default=DEFAULT_QUEUE_TIMEOUT,
+                        help="seconds a request may wait for a provider")
+    parser.add_argument("--tool-timeout", type=float, default=DEFAULT_TOOL_TIMEOUT,
+                        help="seconds each IP agent tool call may take")
+    args = parser.parse_args()
+
+    services = build_services(args.tool_timeout)
+    app = create_app(services, {"google": args.google_limit, "openai": args.openai_limit}, args.max_waiting, args.queue_timeout)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.vectorstores import InMemoryVectorStore
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.tools import Tool, StructuredTool
+from aiohttp import web
+from typing import Optional
+import argparse
+import asyncio
+import aiohttp
+import random
+import json
+import time
+import os
+
+# Placeholder keys let the apps construct their real clients on import; the load test never calls them.
+os.environ.setdefault("GOOGLE_API_KEY", "loadtest")
+os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+os.environ.setdefault("LANGCHAIN_API_KEY", "loadtest")
+os.environ.setdefault("SERPAPI_API_KEY", "loadtest")
+os.environ.setdefault("TRACING_MODE", "off")
+
+from app import Services, create_app, load_app, metrics, DEFAULT_PROVIDER_LIMITS, DEFAULT_MAX_WAITING, DEFAULT_QUEUE_TIMEOUT
+from common.instrumentation import percentile
+
+
+SAMPLE_CODE = """
+#include <string.h>
+int main(int argc, char **argv) {
+    char buffer[16];
+    strcpy(buffer, argv[1]);
+    return 0;
+}
+"""
+
+SAMPLE_CONTEXT = [
+    "The first candidate served as a state attorney general before entering national politics.",
+    "The second candidate ran a business empire before running for office.",
+    "Both candidates have published platforms covering the economy, immigration and foreign policy.",
+]
+
+# What each fake IP agent tool returns, by tool name.
+FAKE_OBSERVATIONS = {
+    "ip_location_info": json.dumps({"city": "Mountain View", "country": "United States", "org": "Google LLC"}),
+    "retrieve_DNS_host": "dns.google",
+    "retrieve_ip": "8.8.8.8",
+    "retrieve_DNS_records": json.dumps({"A": ["8.8.8.8"], "AAAA": [], "NS": [], "MX": []}),
+    "ping_host": json.dumps({"summary": ["2 packets transmitted, 2 received, 0% packet loss"]}),
+}
+
+REQUESTS = {
+    "/vulnerabilities": {"code": SAMPLE_CODE},
+    "/ask": {"query": "What did the first candidate do before national politics?"},
+    "/ip": {"query": "Where is 8.8.8.8 located?"},
+}
+
+
+class FakeProviderModel(BaseChatModel):
+    """
+    Chat model stand-in that answers after a fixed delay and streams its answer word by word.
+    When tools are bound, it asks for one tool call and answers once the tool's result comes back.
+    Counting tokens takes a round trip too, as it does with Gemini.
+    """
+    answer: str = "1. Buffer overflow\n   - Issue: strcpy copies unbounded input.\n   - Recommendation: use a bounded copy."
+    first_token_seconds: float = 0.2
+    token_seconds: float = 0.01
+    tool_name: Optional[str] = None
+    tool_args: dict = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-provider"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def get_num_tokens(self, text) -> int:
+        time.sleep(self.first_token_seconds)
+        return len(text.split())
+
+    def reply(self, messages) -> AIMessage:
+        if self.tool_name and not any(isinstance(message, ToolMessage) for message in messages):
+            return AIMessage(content="", tool_calls=[dict(name=self.tool_name, args=self.tool_args, id="call_1")])
+        return AIMessage(content=self.answer)
+
+    def delay(self) -> float:
+        return self.first_token_seconds + self.token_seconds * len(self.answer.split())
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.delay())
+        return ChatResult(generations=[ChatGeneration(message=self.reply(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.delay())
+        return ChatResult(generations=[ChatGeneration(message=self.reply(messages))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self.reply(messages)
+        await asyncio.sleep(self.first_token_seconds)
+        if message.tool_calls:
+            tool_call = message.tool_calls[0]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                dict(name=tool_call["name"], args=json.dumps(tool_call["args"]), id=tool_call["id"], index=0)
+            ]))
+            return
+
+        for index, word in enumerate(message.content.split(" ")):
+            if index:
+                await asyncio.sleep(self.token_seconds)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def fake_tools(tools, tool_seconds) -> list:
+    """
+    Copies the agent's real tools, keeping their names, descriptions and input validation, but
+    replacing each lookup with a fixed answer after a short delay.
+    :param tools: tools from load_agent_tools
+    :type tools: list
+    :param tool_seconds: time each fake lookup takes
+    :type tool_seconds: float
+    :return: fake tools
+    :rtype: list
+    """
+    def fake_lookup(name):
+        def lookup(*args, **kwargs):
+            time.sleep(tool_seconds)
+            return FAKE_OBSERVATIONS.get(name, "No results.")
+        return lookup
+
+    return [
+        StructuredTool.from_function(func=fake_lookup(base_tool.name), name=base_tool.name, description=base_tool.description, args_schema=base_tool.args_schema)
+        if isinstance(base_tool, StructuredTool) else
+        Tool(name=base_tool.name, func=fake_lookup(base_tool.name), description=base_tool.description)
+        for base_tool in tools
+    ]
+
+
+def build_fake_services(first_token_seconds, token_seconds, tool_seconds) -> Services:
+    """
+    Builds the service's real chains and agent around fake models, an in-memory vector store with
+    fake embeddings and fake lookups behind the IP agent's real tools, so the service can be loaded without any network calls.
+    :param first_token_seconds: delay before a fake model's first token
+    :type first_token_seconds: float
+    :param token_seconds: delay between a fake model's tokens
+    :type token_seconds: float
+    :param tool_seconds: time each fake lookup takes
+    :type tool_seconds: float
+    :return: shared services
+    :rtype: Services
+    """
+    async_chains = load_app("async_chains")
+    political_info_rag = load_app("political_info_rag")
+    ip_info_agent = load_app("ip_info_agent")
+
+    google_llm = FakeProviderModel(first_token_seconds=first_token_seconds, token_seconds=token_seconds)
+    openai_llm = FakeProviderModel(first_token_seconds=first_token_seconds, token_seconds=token_seconds)
+    agent_llm = FakeProviderModel(first_token_seconds=first_token_seconds, token_seconds=token_seconds,
+                                  answer="8.8.8.8 belongs to Google LLC in Mountain View, United States.",
+                                  tool_name="ip_location_info", tool_args={"address": "8.8.8.8"})
+
+    vector_db = InMemoryVectorStore(embedding=DeterministicFakeEmbedding(size=64))
+    vector_db.add_texts(SAMPLE_CONTEXT)
+    retriever = vector_db.as_retriever(search_kwargs={"k": 2})
+
+    return Services(
+        vulnerability_chains={
+            "gemini": ("google", async_chains.create_vulnerability_chain(google_llm)),
+            "gpt": ("openai", async_chains.create_vulnerability_chain(openai_llm)),
+        },
+        rag_chains={
+            "gemini": ("google", political_info_rag.create_query_chain(retriever, google_llm)),
+            "gpt": ("openai", political_info_rag.create_query_chain(retriever, openai_llm)),
+        },
+        ip_agent=("openai", ip_info_agent.create_parallel_executor(fake_tools(ip_info_agent.load_agent_tools(), tool_seconds), ip_info_agent.DEFAULT_TOOL_TIMEOUT, llm=agent_llm, verbose=False)),
+        token_counter=google_llm.get_num_tokens,
+        max_prompt_tokens=async_chains.MAX_PROMPT_TOKENS,
+    )
+
+
+async def send_request(session, url, path) -> dict:
+    """
+    Sends one request and reads its streamed response to the end.
+    :param session: HTTP client session
+    :type session: aiohttp.ClientSession
+    :param url: base URL of the service
+    :type url: str
+    :param path: endpoint to call
+    :type path: str
+    :return: endpoint, status, seconds to the first event and to the end, and whether any source failed
+    :rtype: dict
+    """
+    start = time.perf_counter()
+    first_event = None
+    failed = False
+    async with session.post(url + path, json=REQUESTS[path]) as response:
+        if response.status == 200:
+            async for line in response.content:
+                if first_event is None:
+                    first_event = time.perf_counter() - start
+                failed = failed or json.loads(line).get("type") == "error"
+        else:
+            await response.read()
+    return dict(path=path, status=response.status, first_event=first_event, seconds=time.perf_counter() - start, failed=failed)
+
+
+async def run_load(url, paths, total_requests, concurrency) -> tuple:
+    """
+    Sends requests to random endpoints from a fixed number of concurrent clients.
+    :param url: base URL of the service
+    :type url: str
+    :param paths: endpoints to choose from
+    :type paths: list
+    :param total_requests: number of requests to send
+    :type total_requests: int
+    :param concurrency: clients sending at the same time
+    :type concurrency: int
+    :return: results of every request and the seconds the whole run took
+    :rtype: tuple
+    """
+    pending = [random.choice(paths) for _ in range(total_requests)]
+    results = []
+
+    async def client(session):
+        while pending:
+            path = pending.pop()
+            try:
+                results.append(await send_request(session, url, path))
+            except aiohttp.ClientError as error:
+                results.append(dict(path=path, status=str(error), first_event=None, seconds=None, failed=True))
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(concurrency):
+                tg.create_task(client(session))
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed) -> str:
+    """
+    Formats throughput, rejections and latency percentiles for each endpoint.
+    :param results: results from run_load
+    :type results: list
+    :param elapsed: seconds the whole run took
+    :type elapsed: float
+    :return: one line per endpoint and a total
+    :rtype: str
+    """
+    lines = [f"{'endpoint':<18}{'sent':>6}{'ok':>6}{'503':>6}{'failed':>8}{'first p50':>11}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}"]
+    for path in sorted({result["path"] for result in results}):
+        group = [result for result in results if result["path"] == path]
+        completed = [result for result in group if result["status"] == 200 and not result["failed"]]
+        rejected = sum(1 for result in group if result["status"] == 503)
+        failed = len(group) - len(completed) - rejected
+        line = f"{path:<18}{len(group):>6}{len(completed):>6}{rejected:>6}{failed:>8}"
+        if completed:
+            seconds = sorted(result["seconds"] for result in completed)
+            first_events = sorted(result["first_event"] for result in completed)
+            line += f"{percentile(first_events, 0.5):>11.2f}{percentile(seconds, 0.5):>8.2f}{percentile(seconds, 0.95):>8.2f}{percentile(seconds, 0.99):>8.2f}"
+        lines.append(line)
+
+    completed = sum(1 for result in results if result["status"] == 200 and not result["failed"])
+    lines.append(f"\n{len(results)} requests in {'{:.2f}'.format(elapsed)} seconds, {'{:.1f}'.format(completed / elapsed)} completed per second.")
+    return "\n".join(lines)
+
+
+async def run_in_process(args) -> None:
+    services = build_fake_services(args.first_token_seconds, args.token_seconds, args.tool_seconds)
+    app = create_app(services, {"google": args.google_limit, "openai": args.openai_limit}, args.max_waiting, args.queue_timeout)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+
+    try:
+        results, elapsed = await run_load(f"http://{host}:{port}", args.paths, args.requests, args.concurrency)
+    finally:
+        limiter = app["limiter"]
+        await runner.cleanup()
+
+    print(report(results, elapsed))
+    print(f"\nProvider queue: {json.dumps(limiter.status())}")
+    print(f"\nServer-side stages:\n{metrics.report()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP service, by default in-process against fake models.")
+    parser.add_argument("--url", help="load an already running service instead of starting one with fake models")
+    parser.add_argument("--requests", type=int, default=200, help="requests to send")
+    parser.add_argument("--concurrency", type=int, default=50, help="clients sending at the same time")
+    parser.add_argument("--paths", nargs="+", default=list(REQUESTS), choices=list(REQUESTS), help="endpoints to call")
+    parser.add_argument("--first-token-seconds", type=float, default=0.2, help="fake model delay before its first token")
+    parser.add_argument("--token-seconds", type=float, default=0.01, help="fake model delay between tokens")
+    parser.add_argument("--tool-seconds", type=float, default=0.05, help="time each fake IP agent lookup takes")
+    parser.add_argument("--google-limit", type=int, default=DEFAULT_PROVIDER_LIMITS["google"])
+    parser.add_argument("--openai-limit", type=int, default=DEFAULT_PROVIDER_LIMITS["openai"])
+    parser.add_argument("--max-waiting", type=int, default=DEFAULT_MAX_WAITING)
+    parser.add_argument("--queue-timeout", type=float, default=DEFAULT_QUEUE_TIMEOUT)
+    args = parser.parse_args()
+
+    if args.url:
+        results, elapsed = asyncio.run(run_load(args.url.rstrip("/"), args.paths, args.requests, args.concurrency))
+        print(report(results, elapsed))
+    else:
+        asyncio.run(run_in_process(args))
+
+
+if __name__ == "__main__":
+    main()